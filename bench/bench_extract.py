@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Extraction throughput benchmark that runs on any platform by putting fake_osascript.py on PATH as osascript
+and pointing the sqlite backend at a NoteStore.sqlite built by fake_note_store.py.
+
+It reports notes/sec, MB/sec and peak RSS for the frame parser alone (reading a pre-generated stream
+from disk) and for each requested extraction backend end to end. Every measurement runs in a fresh
+Python process, so its peak RSS is its own; the growth over the RSS after importing the app is shown too.
+
+    python bench/bench_extract.py --notes 20000 --size 2000 --backend osascript --backend bulk --backend sqlite
+
+Each backend's notes are then read again in a separate process and their titles, bodies and dates checked
+against the generated notes; it exits with status 1 if any backend extracts a different number of notes
+than were generated or any note that does not match.
+"""
+import argparse
+import json
+import os
+import resource
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import chat_apple_notes  # noqa: E402
+import fake_note_store  # noqa: E402
+from fake_osascript import generate_note  # noqa: E402
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def measure(notes: Iterable[Dict[str, str]]) -> Dict[str, float]:
+    """Consume the notes and return the counts, timing and RSS of this process."""
+    baseline_rss = peak_rss_mb()
+    start = time.perf_counter()
+    count = size = 0
+    for note in notes:
+        count += 1
+        size += len(note["body"].encode())
+    return {"notes": count, "size": size, "elapsed": time.perf_counter() - start,
+            "peak_rss": peak_rss_mb(), "baseline_rss": baseline_rss}
+
+def mismatched_notes(notes: Iterable[Dict[str, str]], backend: str) -> Dict[str, int]:
+    """Count the notes whose title, body or dates differ from the generated note with the same id."""
+    count = mismatched = 0
+    for note in notes:
+        count += 1
+        _, created, updated, _, title, body = generate_note(int(note["id"].rsplit("/p", 1)[1]))
+        if backend == "sqlite":
+            # The stored text keeps the attachment placeholder, which extraction must strip
+            body = fake_note_store.note_text(body).replace("\ufffc", "").strip()
+        else:
+            body = chat_apple_notes.html_to_text(body.strip())
+        if (note["title"], note["body"], note["created"], note["updated"]) != (title, body, created, updated):
+            if not mismatched:
+                print(f"{backend}: {note['id']} does not match the generated note", file=sys.stderr)
+            mismatched += 1
+    return {"notes": count, "mismatched": mismatched}
+
+def run_child(args: argparse.Namespace) -> None:
+    """Run a single measurement or check in this process and print its result as JSON on the last line."""
+    if args.child == "parser":
+        with open(args.stream, "rb") as stream:
+            result = measure(chat_apple_notes.parse_note_frames(chat_apple_notes.read_frames(stream, args.split)))
+    else:
+        if args.note_store:
+            chat_apple_notes.NOTE_STORE_PATH = args.note_store
+        assistant = chat_apple_notes.NotesAssistant.__new__(chat_apple_notes.NotesAssistant)
+        assistant.config = chat_apple_notes.NotesAssistantConfig.__new__(chat_apple_notes.NotesAssistantConfig)
+        assistant.config.config = {}
+        notes = assistant.extract_notes(args.child, workers=args.workers)
+        result = mismatched_notes(notes, args.child) if args.check else measure(notes)
+    print(json.dumps(result))
+
+def run_child_process(name: str, extra_args: List[str]) -> Dict[str, float]:
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, *extra_args],
+                            stdout=subprocess.PIPE, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_measurement(name: str, extra_args: List[str]) -> Dict[str, float]:
+    """Measure in a fresh process, print a result row and return the result with its MB/sec."""
+    result = run_child_process(name, extra_args)
+    result["mb_per_sec"] = result["size"] / result["elapsed"] / 1e6
+    print(f"{name:<12} {result['notes']:>8} notes {result['elapsed']:>8.2f}s {result['notes'] / result['elapsed']:>10.0f} notes/s "
+          f"{result['mb_per_sec']:>8.2f} MB/s {result['peak_rss']:>8.1f} MB peak RSS "
+          f"(+{result['peak_rss'] - result['baseline_rss']:.1f} MB)")
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=5000, help="Number of generated notes")
+    parser.add_argument("--size", type=int, default=2000, help="Median body size in bytes")
+    parser.add_argument("--distribution", default="lognormal", choices=("lognormal", "uniform", "fixed"))
+    parser.add_argument("--backend", action="append", choices=chat_apple_notes.EXTRACTION_BACKENDS,
+                        help="Extraction backend to benchmark end to end (repeatable)")
+    parser.add_argument("--workers", type=int, default=None, help="Workers for the parallel backend")
+    parser.add_argument("--min-parser-mb-per-sec", type=float, default=None,
+                        help="Exit with status 1 if parser throughput falls below this value")
+    # Used by the child processes that run each measurement
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--stream", help=argparse.SUPPRESS)
+    parser.add_argument("--split", help=argparse.SUPPRESS)
+    parser.add_argument("--note-store", help=argparse.SUPPRESS)
+    parser.add_argument("--check", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as bin_dir:
+        os.symlink(os.path.join(BENCH_DIR, "fake_osascript.py"), os.path.join(bin_dir, "osascript"))
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+        os.environ.update(FAKE_NOTES_COUNT=str(args.notes), FAKE_NOTES_SIZE=str(args.size),
+                          FAKE_NOTES_DISTRIBUTION=args.distribution)
+
+        split = secrets.token_hex(8)
+        script = chat_apple_notes.EXTRACT_SCRIPT.format(split=split, prelude="", notes="(every note)")
+        stream_path = os.path.join(bin_dir, "stream")
+        with open(stream_path, "wb") as stream:
+            subprocess.run(["osascript", "-e", script], stderr=stream, check=True)
+        print(f"Generated {os.path.getsize(stream_path) / 1e6:.1f} MB stream for {args.notes} notes\n")
+
+        parser_mb_per_sec = run_measurement("parser", ["--stream", stream_path, "--split", split])["mb_per_sec"]
+        os.remove(stream_path)
+
+        miscounted, mismatched = [], []
+        for backend in args.backend or ():
+            extra_args = ["--workers", str(args.workers)] if args.workers else []
+            if backend == "sqlite":
+                note_store = os.path.join(bin_dir, "NoteStore.sqlite")
+                fake_note_store.build(note_store)
+                extra_args += ["--note-store", note_store]
+            if run_measurement(backend, extra_args)["notes"] != args.notes:
+                miscounted.append(backend)
+            if run_child_process(backend, extra_args + ["--check"])["mismatched"]:
+                mismatched.append(backend)
+
+    if miscounted:
+        print(f"\nExtracted a different number of notes than the {args.notes} generated with: {', '.join(miscounted)}")
+    if mismatched:
+        print(f"\nExtracted notes that differ from the generated ones with: {', '.join(mismatched)}")
+    if miscounted or mismatched:
+        sys.exit(1)
+    if args.min_parser_mb_per_sec is not None and parser_mb_per_sec < args.min_parser_mb_per_sec:
+        print(f"\nParser throughput {parser_mb_per_sec:.2f} MB/s is below {args.min_parser_mb_per_sec} MB/s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Build a synthetic NoteStore.sqlite for the sqlite extraction backend, so it can be exercised off macOS.
+
+The store holds the notes fake_osascript.py generates, as plain text in gzipped NoteStoreProto blobs,
+plus one password-protected note and one note marked for deletion that extraction must skip. It is
+configured through the same FAKE_NOTES_* environment variables:
+
+    python bench/fake_note_store.py /tmp/NoteStore.sqlite
+"""
+import gzip
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+from fake_osascript import generate_note
+
+STORE_UUID = "FAKE-STORE"
+CORE_DATA_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+SCHEMA = """
+CREATE TABLE Z_METADATA (Z_VERSION INTEGER PRIMARY KEY, Z_UUID TEXT, Z_PLIST BLOB);
+CREATE TABLE ZICCLOUDSYNCINGOBJECT (
+    Z_PK INTEGER PRIMARY KEY, ZIDENTIFIER TEXT, ZTITLE1 TEXT, ZTITLE2 TEXT, ZFOLDER INTEGER,
+    ZCREATIONDATE3 REAL, ZMODIFICATIONDATE1 REAL, ZNOTEDATA INTEGER,
+    ZMARKEDFORDELETION INTEGER, ZISPASSWORDPROTECTED INTEGER
+);
+CREATE TABLE ZICNOTEDATA (Z_PK INTEGER PRIMARY KEY, ZNOTE INTEGER, ZDATA BLOB);
+"""
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+def field(number: int, payload: bytes) -> bytes:
+    """Encode a length-delimited protobuf field."""
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+def note_data(text: str) -> bytes:
+    """Encode note text the way Notes stores it: gzip(NoteStoreProto{document: {note: {note_text}}})."""
+    # Version fields and an attribute run sit around the text, as in real blobs, so the decoder has to skip them
+    note = varint(1 << 3) + varint(1) + field(2, text.encode()) + field(5, varint(1 << 3) + varint(len(text)))
+    document = varint(2 << 3) + varint(0) + field(3, note)
+    return gzip.compress(field(2, document))
+
+def core_data_time(value: str) -> float:
+    # Dates are local time, as in the «class isot» strings fake_osascript.py returns for the same notes
+    return datetime.fromisoformat(value).timestamp() - CORE_DATA_EPOCH.timestamp()
+
+def note_text(body: str) -> str:
+    """The plain text Notes stores for a generated HTML body."""
+    text = re.sub(r"<[^>]+>", "", re.sub(r"</div>|<br>|</li>", "\n", body))
+    # Attachments leave an object replacement character in the text
+    return text.replace("\n", "\ufffc\n", 1)
+
+def build(path: str) -> None:
+    total = int(os.environ.get("FAKE_NOTES_COUNT", "1000"))
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT INTO Z_METADATA (Z_VERSION, Z_UUID) VALUES (1, ?)", (STORE_UUID,))
+    folders = {}
+    for i in range(1, total + 3):
+        _, created, updated, folder, title, body = generate_note(min(i, total) if total else 1)
+        # Z_PK values of folders and notes share one sequence, as in Core Data
+        folder_pk = folders.setdefault(folder, len(folders) + 1_000_000)
+        protected, deleted = i == total + 1, i == total + 2
+        data = os.urandom(64) if protected else note_data(note_text(body))
+        conn.execute("INSERT INTO ZICNOTEDATA (Z_PK, ZNOTE, ZDATA) VALUES (?, ?, ?)", (i, i, data))
+        conn.execute(
+            "INSERT INTO ZICCLOUDSYNCINGOBJECT (Z_PK, ZIDENTIFIER, ZTITLE1, ZFOLDER, ZCREATIONDATE3, ZMODIFICATIONDATE1, "
+            "ZNOTEDATA, ZMARKEDFORDELETION, ZISPASSWORDPROTECTED) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (i, f"FAKE-NOTE-{i}", title, folder_pk, core_data_time(created), core_data_time(updated), i, int(deleted), int(protected)))
+    conn.executemany("INSERT INTO ZICCLOUDSYNCINGOBJECT (Z_PK, ZIDENTIFIER, ZTITLE2) VALUES (?, ?, ?)",
+                     ((pk, f"FAKE-FOLDER-{pk}", "Notes") for pk in folders.values()))
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    build(sys.argv[1])
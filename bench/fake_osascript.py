@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Stand-in for macOS osascript that answers the scripts chat_apple_notes.py sends to Notes.app.
+
+Notes are generated deterministically, so repeated runs produce the same content and hashes.
+The library is configured through environment variables:
+
+    FAKE_NOTES_COUNT         number of notes in the library (default 1000)
+    FAKE_NOTES_DISTRIBUTION  body size distribution: lognormal, uniform or fixed (default lognormal)
+    FAKE_NOTES_SIZE          median body size in bytes (default 2000)
+    FAKE_NOTES_SEED          random seed (default 0)
+"""
+import os
+import random
+import re
+import sys
+from typing import Iterator, Tuple
+
+WORDS = ("meeting", "follow", "up", "groceries", "idea", "project", "draft", "call", "résumé", "café", "naïve",
+         "📝", "✅", "budget", "Q3", "roadmap", "notes", "todo", "remember", "book", "flight", "日本語")
+
+def body_size(rng: random.Random) -> int:
+    size = int(os.environ.get("FAKE_NOTES_SIZE", "2000"))
+    distribution = os.environ.get("FAKE_NOTES_DISTRIBUTION", "lognormal")
+    if distribution == "fixed":
+        return size
+    if distribution == "uniform":
+        return rng.randint(1, 2 * size)
+    if distribution == "lognormal":
+        return max(1, int(rng.lognormvariate(0, 1) * size))
+    raise SystemExit(f"Unknown FAKE_NOTES_DISTRIBUTION {distribution}")
+
+def generate_note(index: int) -> Tuple[str, str, str, str, str, str]:
+    """Return the id, created, updated, folder, title and HTML body of a note."""
+    rng = random.Random(f"{os.environ.get('FAKE_NOTES_SEED', '0')}-{index}")
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))).capitalize()
+    target = body_size(rng)
+    lines, size = [f"<div><h1>{title}</h1></div>"], 0
+    while size < target:
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+        line = rng.choice(("<div>{}</div>", "<ul><li>{}</li></ul>", "<div><b>{}</b></div>", "<div>{}<br></div>")).format(text)
+        lines.append(line)
+        size += len(line.encode())
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    return (
+        f"x-coredata://FAKE-STORE/ICNote/p{index}",
+        f"2023-{month:02d}-{day:02d}T09:00:00",
+        f"2024-{month:02d}-{day:02d}T17:30:00",
+        f"x-coredata://FAKE-STORE/ICFolder/p{index % 7 + 1}",
+        title,
+        "\n".join(lines),
+    )
+
+def emit(out, split: str, key: str, value) -> None:
+    data = str(value).encode()
+    out.write(f"{split} {key} {len(data)}\n".encode() + data + b"\n")
+
+def note_range(script: str, total: int) -> Iterator[int]:
+    picked = re.findall(r'note id "[^"]*/ICNote/p(\d+)"', script)
+    if picked:
+        return iter(index for index in dict.fromkeys(map(int, picked)) if index <= total)
+    match = re.search(r"notes (\d+) thru (\d+)", script)
+    start, end = (int(match.group(1)), int(match.group(2))) if match else (1, total)
+    return iter(range(start, min(end, total) + 1))
+
+def main() -> None:
+    script = sys.argv[sys.argv.index("-e") + 1]
+    total = int(os.environ.get("FAKE_NOTES_COUNT", "1000"))
+    if "whose modification date" in script:
+        # Every generated note was last modified in 2024, before any sync watermark
+        total = 0
+    if "my emit(" not in script:
+        if "get count of" in script:
+            print(total)
+        elif "get id of every note" in script:
+            print(", ".join(generate_note(i)[0] for i in range(1, total + 1)))
+        else:
+            raise SystemExit(f"fake_osascript does not understand this script:\n{script}")
+        return
+    split = re.search(r'log "([0-9a-f]+) "', script).group(1)
+    # osascript writes log output to stderr
+    out = sys.stderr.buffer
+    if 'my emit("member"' in script:
+        match = re.search(r"by (\d+)", script)
+        chunk_size = int(match.group(1)) if match else max(total, 1)
+        emit(out, split, "count", total)
+        for i in range(1, total + 1):
+            note_id, _, _, folder, _, _ = generate_note(i)
+            emit(out, split, "member", f"{folder} {note_id}")
+        for start in range(1, total + 1, chunk_size):
+            notes = [generate_note(i) for i in range(start, min(start + chunk_size, total + 1))]
+            for key, position in (("id", 0), ("title", 4), ("created", 1), ("updated", 2), ("body", 5), ("check", 0)):
+                for note in notes:
+                    emit(out, split, key, note[position])
+            emit(out, split, "end", "")
+        return
+    indexes = list(note_range(script, total))
+    emit(out, split, "count", len(indexes))
+    for i in indexes:
+        note_id, created, updated, folder, title, body = generate_note(i)
+        for key, value in (("id", note_id), ("created", created), ("updated", updated),
+                           ("folder", folder), ("title", title), ("body", body)):
+            emit(out, split, key, value)
+
+if __name__ == "__main__":
+    main()
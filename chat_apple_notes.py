@@ -8,15 +8,96 @@ import typer
 import sys
 import time
 import json
-from openai import OpenAI
-from typing import Dict, List, Generator, Optional
+import gzip
+import re
+import math
+import queue
+import threading
+import random
+import asyncio
+import zlib
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from urllib.parse import quote
+from openai import (APIConnectionError, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, InternalServerError,
+                    NotFoundError, OpenAI, RateLimitError)
+from itertools import islice
+from typing import Any, BinaryIO, Callable, Dict, List, Generator, Iterable, Iterator, NamedTuple, Optional, Set, Tuple, Union
 
 app = typer.Typer()
 CONFIG_FILE = os.path.expanduser("~/chat_apple_notes_config.json")
+STATE_FILE = os.path.expanduser("~/chat_apple_notes_state.sqlite")
+NOTE_STORE_PATH = os.path.expanduser("~/Library/Group Containers/group.com.apple.notes/NoteStore.sqlite")
+EXTRACTION_BACKENDS = ("osascript", "bulk", "parallel", "sqlite")
+# Notes fetched per round of bulk property reads; bounds how many bodies the bulk backend holds at once
+BULK_CHUNK_SIZE = 200
+# Core Data timestamps count seconds from 2001-01-01 UTC rather than the Unix epoch
+CORE_DATA_EPOCH_OFFSET = 978307200
+DEFAULT_EXTRACTION_WORKERS = 4
+# Index ranges handed out per parallel worker, so a slow range does not leave the other workers idle
+PARALLEL_SHARDS_PER_WORKER = 4
+# Parsed notes buffered between the parallel workers and the consumer
+PARALLEL_QUEUE_SIZE = 256
+# Concurrent requests used to delete stale vector store files
+DELETE_WORKERS = 8
+# Files added to the vector store per file batch; the API accepts at most 500 per batch
+DEFAULT_UPLOAD_BATCH_SIZE = 100
+MAX_UPLOAD_BATCH_SIZE = 500
+# In packing mode, notes whose serialized section is at most this many bytes are packed into shared bundle files
+PACK_NOTE_THRESHOLD = 4096
+# Size bundles are filled up to
+PACK_TARGET_SIZE = 32768
+# Concurrent file upload requests made by the async upload engine
+DEFAULT_UPLOAD_CONCURRENCY = 16
+# File batches uploading at once; bounds the serialized files held in memory to this many batches
+MAX_PENDING_BATCHES = 4
+# Attempts per request on rate limits, server errors and dropped connections, with exponential backoff and jitter
+UPLOAD_ATTEMPTS = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Seconds between checks of outstanding file batches, while waiting on them and from other commands
+BATCH_POLL_INTERVAL = 2.0
+BATCH_CHECK_INTERVAL = 30.0
+# Rough request body bytes per model token, used to charge JSON requests against the token budget up front
+BYTES_PER_TOKEN = 4
+# Characters of note HTML fed to the text converter at a time
+HTML_FEED_SIZE = 65536
+# Items buffered between each stage of the upload pipeline, which bounds how many note bodies are held at once
+PIPELINE_QUEUE_SIZE = 64
+# Notes resolved per identifier query; stays under SQLite's default limit of 999 bound parameters
+REAL_ID_BATCH_SIZE = 500
+# Extra seconds re-extracted before the watermark to absorb clock skew and osascript startup time
+WATERMARK_SLACK_SECONDS = 300
+# Notes whose text exceeds this many bytes are split into content-defined chunks uploaded as separate files
+CHUNKING_THRESHOLD = 32768
+CHUNK_MIN_SIZE = 2048
+CHUNK_MAX_SIZE = 32768
+# A chunk boundary is cut where the top bits of the rolling hash are zero, giving chunks of about 8 KB on average
+CHUNK_BOUNDARY_MASK = ((1 << 13) - 1) << (64 - 13)
+# Random 64-bit value per byte for the gear rolling hash, derived deterministically so boundaries are stable across runs
+GEAR_TABLE = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], "big") for value in range(256)]
 
-EXTRACT_SCRIPT = """
-tell application "Notes"
-   repeat with eachNote in every note
+# Every field is logged as a "<split> <key> <byte length>" header line followed by exactly that many UTF-8 bytes,
+# so the parser never has to scan note bodies for markers
+FRAME_HANDLER = """
+use AppleScript version "2.4"
+use framework "Foundation"
+use scripting additions
+
+on emit(fieldKey, fieldValue)
+   set fieldText to fieldValue as text
+   set byteCount to (current application's NSString's stringWithString:fieldText)'s lengthOfBytesUsingEncoding:(current application's NSUTF8StringEncoding)
+   log "{split} " & fieldKey & " " & byteCount & linefeed & fieldText
+end emit
+""".lstrip()
+
+EXTRACT_SCRIPT = FRAME_HANDLER + """
+{prelude}tell application "Notes"
+   my emit("count", count of {notes})
+   repeat with eachNote in {notes}
       set noteId to the id of eachNote
       set noteTitle to the name of eachNote
       set noteBody to the body of eachNote
@@ -26,25 +107,919 @@ tell application "Notes"
       set noteUpdated to (noteUpdatedDate as «class isot» as string)
       set noteContainer to container of eachNote
       set noteFolderId to the id of noteContainer
-      log "{split}-id: " & noteId & "\n"
-      log "{split}-created: " & noteCreated & "\n"
-      log "{split}-updated: " & noteUpdated & "\n"
-      log "{split}-folder: " & noteFolderId & "\n"
-      log "{split}-title: " & noteTitle & "\n\n"
-      log noteBody & "\n"
-      log "{split}{split}" & "\n"
+      my emit("id", noteId)
+      my emit("created", noteCreated)
+      my emit("updated", noteUpdated)
+      my emit("folder", noteFolderId)
+      my emit("title", noteTitle)
+      my emit("body", noteBody)
    end repeat
 end tell
 """.strip()
 
+BULK_EXTRACT_SCRIPT = FRAME_HANDLER + """
+{prelude}tell application "Notes"
+   set noteCount to count of (every note{filter})
+   my emit("count", noteCount)
+   repeat with eachFolder in every folder
+      set folderId to the id of eachFolder
+      repeat with memberId in (id of every note of eachFolder{filter})
+         my emit("member", folderId & " " & (contents of memberId))
+      end repeat
+   end repeat
+   repeat with chunkStart from 1 to noteCount by {chunk_size}
+      set chunkEnd to chunkStart + {chunk_size} - 1
+      if chunkEnd > noteCount then set chunkEnd to noteCount
+      set noteIds to id of {chunk}
+      set noteTitles to name of {chunk}
+      set noteCreatedDates to creation date of {chunk}
+      set noteUpdatedDates to modification date of {chunk}
+      set noteBodies to body of {chunk}
+      -- Read again so notes added or deleted while the chunk was read are detected
+      set checkIds to id of {chunk}
+      repeat with noteId in noteIds
+         my emit("id", contents of noteId)
+      end repeat
+      repeat with noteTitle in noteTitles
+         my emit("title", contents of noteTitle)
+      end repeat
+      repeat with noteCreatedDate in noteCreatedDates
+         my emit("created", (contents of noteCreatedDate) as «class isot» as string)
+      end repeat
+      repeat with noteUpdatedDate in noteUpdatedDates
+         my emit("updated", (contents of noteUpdatedDate) as «class isot» as string)
+      end repeat
+      repeat with noteBody in noteBodies
+         my emit("body", contents of noteBody)
+      end repeat
+      repeat with checkId in checkIds
+         my emit("check", contents of checkId)
+      end repeat
+      my emit("end", "")
+   end repeat
+end tell
+""".strip()
+
+COUNT_SCRIPT = """
+{prelude}tell application "Notes" to get count of (every note{filter})
+""".strip()
+
+NOTE_IDS_SCRIPT = """
+tell application "Notes" to get id of every note
+""".strip()
+
+NOTE_STORE_QUERY = """
+SELECT note.Z_PK, note.ZIDENTIFIER, note.ZTITLE1, note.ZFOLDER, note.{created}, note.{updated}, data.ZDATA
+FROM ZICCLOUDSYNCINGOBJECT AS note
+JOIN ZICNOTEDATA AS data ON data.Z_PK = note.ZNOTEDATA
+WHERE IFNULL(note.ZMARKEDFORDELETION, 0) = 0 AND IFNULL(note.ZISPASSWORDPROTECTED, 0) = 0
+""".strip()
+
+# Each entry upgrades the sync state database by one schema version, tracked in PRAGMA user_version
+STATE_MIGRATIONS = [
+    """
+    CREATE TABLE notes (
+        note_id TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        file_id TEXT,
+        uploaded_at TEXT,
+        size INTEGER
+    );
+    CREATE INDEX notes_hash ON notes (hash);
+    -- Hashes imported from the config file, which were never associated with a note id
+    CREATE TABLE legacy_hashes (hash TEXT PRIMARY KEY);
+    """,
+    """
+    -- Vector store files that no longer back a live note and are waiting to be deleted
+    CREATE TABLE stale_files (file_id TEXT PRIMARY KEY);
+    """,
+    """
+    -- Modification date of the note version the stored hash was computed from
+    ALTER TABLE notes ADD COLUMN updated TEXT;
+    """,
+    """
+    -- Vector store files holding the content-defined chunks of long notes
+    CREATE TABLE chunks (
+        note_id TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        size INTEGER,
+        PRIMARY KEY (note_id, hash)
+    );
+    """,
+    """
+    -- Files whose upload has started but whose result has not been recorded yet
+    CREATE TABLE pending_uploads (filename TEXT PRIMARY KEY, started_at TEXT);
+    """,
+    """
+    -- Vector store files that pack many small notes; dirty bundles hold an outdated or deleted member
+    CREATE TABLE bundles (
+        bundle_id TEXT PRIMARY KEY,
+        file_id TEXT,
+        size INTEGER,
+        dirty INTEGER NOT NULL DEFAULT 0
+    );
+    -- The bundle each packed note lives in, with its compressed section so bundles can be rebuilt without re-extraction
+    CREATE TABLE bundle_members (note_id TEXT PRIMARY KEY, bundle_id TEXT NOT NULL, content BLOB);
+    CREATE INDEX bundle_members_bundle ON bundle_members (bundle_id);
+    """,
+    """
+    -- Vector store file batches created but not yet seen to finish indexing
+    CREATE TABLE upload_batches (batch_id TEXT PRIMARY KEY, created_at TEXT, file_count INTEGER);
+    """,
+    """
+    -- File batch holding the replacement of a stale file, which is kept until that batch has finished indexing
+    ALTER TABLE stale_files ADD COLUMN batch_id TEXT;
+    """,
+    """
+    -- Notes forgotten because their files failed to index, which the next incremental upload extracts by id
+    CREATE TABLE requeued_notes (note_id TEXT PRIMARY KEY);
+    """,
+    """
+    -- Vector store files uploaded before the sync state tracked file ids, deleted once a full sync has replaced them
+    CREATE TABLE baseline_files (file_id TEXT PRIMARY KEY);
+    """,
+    """
+    -- Legacy hashes no longer match any note since the hash format changed, and notes adopted from them were
+    -- never uploaded by a tracked sync, so their only copy is a baseline file; they are uploaded again instead
+    DELETE FROM legacy_hashes;
+    DELETE FROM notes WHERE uploaded_at IS NULL;
+    """,
+]
+
 #error handling
 class DiskAccessError(Exception):
     """Raised when disk access is required but not granted."""
     pass
 
+class ExtractionError(Exception):
+    """Raised when an extraction script fails or stops before it has read every note it counted."""
+    pass
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yield successive lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+#pipeline helpers
+PIPELINE_DONE = object()
+
+def queue_put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put item on a bounded queue, giving up once stop is set. Returns whether the item was queued."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def queue_drain(q: queue.Queue, stop: threading.Event) -> Generator[Any, None, None]:
+    """Yield items from a queue until PIPELINE_DONE arrives or stop is set."""
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is PIPELINE_DONE:
+            return
+        yield item
+
+def start_stage(target: Callable[..., None], *args: Any, stop: threading.Event, errors: List[BaseException]) -> threading.Thread:
+    """Run a pipeline stage in a background thread, stopping the whole pipeline if it fails."""
+    def run() -> None:
+        try:
+            target(*args)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+#NoteStore.sqlite decoding
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Read a protobuf varint starting at pos, returning the value and the next position."""
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+def protobuf_field(data: bytes, field_number: int) -> Optional[bytes]:
+    """Return the first length-delimited value of field_number in a protobuf message."""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            _, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            if number == field_number:
+                return data[pos:pos + length]
+            pos += length
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+    return None
+
+def decode_note_body(zdata: Optional[bytes]) -> str:
+    """
+    Decode the text of a note from its ZICNOTEDATA.ZDATA blob.
+
+    The blob is a gzipped NoteStoreProto message: document (field 2) -> note (field 3) -> note_text (field 2).
+    """
+    if not zdata:
+        return ""
+    if zdata[:2] == b"\x1f\x8b":
+        zdata = gzip.decompress(zdata)
+    document = protobuf_field(zdata, 2)
+    note = protobuf_field(document, 3) if document else None
+    text = protobuf_field(note, 2) if note else None
+    if text is None:
+        return ""
+    # Attachments are stored out of line and leave an object replacement character in the text
+    return text.decode("utf-8", errors="replace").replace("\ufffc", "").strip()
+
+def note_selection(since: Optional[datetime]) -> Tuple[str, str]:
+    """
+    Build the AppleScript needed to select only notes modified after since.
+
+    Returns:
+        Tuple[str, str]: A prelude to run before talking to Notes and a whose clause to append to note specifiers.
+    """
+    if since is None:
+        return "", ""
+    # Dates are compared relative to the Mac's clock so no locale-dependent date literal is needed
+    age = max(0, int(time.time() - since.timestamp())) + WATERMARK_SLACK_SECONDS
+    return f"set watermark to (current date) - {age}\n", " whose modification date > watermark"
+
+def read_frames(stream: BinaryIO, split: str, messages: Optional[List[str]] = None) -> Generator[Tuple[str, bytes], None, None]:
+    """
+    Read the length-prefixed fields logged by FRAME_HANDLER.
+
+    Args:
+        stream (BinaryIO): The merged output of the extraction script.
+        split (str): The marker that starts every frame header.
+        messages (Optional[List[str]]): If provided, collects the lines that are not frames, such as osascript errors.
+
+    Yields:
+        Tuple[str, bytes]: The key of each field and its raw UTF-8 value.
+    """
+    marker = split.encode()
+    while True:
+        header = stream.readline()
+        if not header:
+            return
+        parts = header.split()
+        # Anything that is not a frame header, such as an osascript error message, is skipped
+        if len(parts) != 3 or parts[0] != marker or not parts[2].isdigit():
+            if messages is not None and header.strip():
+                messages.append(header.decode("utf-8", errors="replace").strip())
+            continue
+        value = stream.read(int(parts[2]))
+        stream.read(1)  # newline appended by log
+        yield parts[1].decode(), value
+
+def finish_extraction(process: subprocess.Popen, messages: List[str], extracted: int, expected: int) -> None:
+    """
+    Wait for an extraction script that has finished logging and check that it read every note it counted.
+
+    Raises:
+        ExtractionError: If the script exited with an error or logged a different number of notes than it counted.
+    """
+    process.wait()
+    if process.returncode:
+        detail = f": {messages[-1]}" if messages else ""
+        raise ExtractionError(f"osascript exited with status {process.returncode} after {extracted} of {expected} notes{detail}")
+    if extracted != expected:
+        raise ExtractionError(f"Extracted {extracted} notes but Notes counted {expected}")
+
+def until_extraction_error(notes: Iterable[Dict[str, str]], errors: List[ExtractionError]) -> Generator[Dict[str, str], None, None]:
+    """Yield notes until the extraction fails, collecting the ExtractionError instead of raising it."""
+    try:
+        yield from notes
+    except ExtractionError as e:
+        errors.append(e)
+
+def parse_note_frames(frames: Iterable[Tuple[str, bytes]]) -> Generator[Dict[str, str], None, None]:
+    """Assemble the frames logged by EXTRACT_SCRIPT into notes without content hashes or link identifiers."""
+    note: Dict[str, str] = {}
+    for key, value in frames:
+        if key == "count":
+            continue
+        note[key] = value.decode("utf-8", errors="replace")
+        # The body is the last field logged for each note
+        if key == "body":
+            if note.get("id"):
+                note["body"] = note["body"].strip()
+                yield note
+            note = {}
+
+#note body normalization
+class NoteTextParser(HTMLParser):
+    """
+    Incrementally convert the HTML bodies Notes.app returns into plain text.
+
+    Headings become markdown-style "#" lines, list items become "-" or numbered lines indented by
+    nesting depth, and checklist items become "[ ]" or "[x]" lines.
+    """
+    BLOCK_TAGS = {"div", "p", "blockquote", "pre", "table", "tr", "hr"}
+    HEADING_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+    SKIPPED_TAGS = {"script", "style", "head", "title"}
+    WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.lists: List[Dict[str, Any]] = []
+        self.skip_depth = 0
+        # Nothing at all has been written on the current line
+        self.line_start = True
+        # No text has been written on the current line yet, though a list marker may have been
+        self.strip_data = True
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+        self.line_start = False
+
+    def newline(self) -> None:
+        if not self.line_start:
+            self.parts.append("\n")
+        self.line_start = self.strip_data = True
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        classes = (dict(attrs).get("class") or "").split()
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag == "br":
+            self.parts.append("\n")
+            self.line_start = self.strip_data = True
+        elif tag in self.HEADING_TAGS:
+            self.newline()
+            self.write("#" * self.HEADING_TAGS[tag] + " ")
+        elif tag in ("ul", "ol"):
+            self.newline()
+            self.lists.append({"ordered": tag == "ol", "count": 0, "checklist": "checklist" in classes})
+        elif tag == "li":
+            self.newline()
+            current = self.lists[-1] if self.lists else {"ordered": False, "count": 0, "checklist": False}
+            current["count"] += 1
+            if "checked" in classes:
+                marker = "[x] "
+            elif current["checklist"] or "unchecked" in classes:
+                marker = "[ ] "
+            elif current["ordered"]:
+                marker = f"{current['count']}. "
+            else:
+                marker = "- "
+            self.write("  " * max(len(self.lists) - 1, 0) + marker)
+        elif tag in ("td", "th"):
+            if not self.strip_data:
+                self.write(" | ")
+        elif tag in self.BLOCK_TAGS:
+            self.newline()
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in ("ul", "ol"):
+            if self.lists:
+                self.lists.pop()
+            self.newline()
+        elif tag in self.BLOCK_TAGS or tag in self.HEADING_TAGS or tag == "li":
+            self.newline()
+
+    def handle_data(self, data: str) -> None:
+        if self.skip_depth:
+            return
+        text = self.WHITESPACE.sub(" ", data)
+        if self.strip_data:
+            text = text.lstrip()
+        if text:
+            self.write(text)
+            self.strip_data = False
+
+    def text(self) -> str:
+        self.close()
+        lines = "".join(self.parts).split("\n")
+        return re.sub(r"\n{3,}", "\n\n", "\n".join(line.rstrip() for line in lines)).strip()
+
+def html_to_text(html: str) -> str:
+    """Convert a note's HTML body to plain text, feeding the parser in chunks."""
+    parser = NoteTextParser()
+    for start in range(0, len(html), HTML_FEED_SIZE):
+        parser.feed(html[start:start + HTML_FEED_SIZE])
+    return parser.text()
+
+def chunk_text(text: str) -> List[str]:
+    """
+    Split text into content-defined chunks using a gear rolling hash.
+
+    Boundaries depend only on the bytes just before them, so an edit changes the chunk it falls in
+    (and occasionally its neighbour) while every other chunk stays byte-for-byte identical.
+    """
+    data = text.encode()
+    chunks: List[str] = []
+    start = 0
+    while len(data) - start > CHUNK_MAX_SIZE:
+        end = start + CHUNK_MAX_SIZE
+        rolling = 0
+        for i in range(start + CHUNK_MIN_SIZE, start + CHUNK_MAX_SIZE):
+            rolling = ((rolling << 1) + GEAR_TABLE[data[i]]) & 0xFFFFFFFFFFFFFFFF
+            # Never cut inside a multi-byte UTF-8 sequence
+            if not rolling & CHUNK_BOUNDARY_MASK and data[i + 1] & 0xC0 != 0x80:
+                end = i + 1
+                break
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        chunks.append(data[start:end].decode())
+        start = end
+    chunks.append(data[start:].decode())
+    return chunks
+
+def core_data_timestamp(value: Optional[float]) -> str:
+    """Convert a Core Data timestamp into the local ISO format AppleScript's «class isot» produces."""
+    if value is None:
+        return ""
+    return datetime.fromtimestamp(value + CORE_DATA_EPOCH_OFFSET).isoformat(timespec="seconds")
+
+class UploadRecord(NamedTuple):
+    """A note version that has been uploaded to the vector store."""
+    note_id: str
+    hash: str
+    file_id: Optional[str]
+    size: int
+    updated: Optional[str]
+    # (chunk hash, file id, size) of every chunk of a long note, which has no file of its own
+    chunks: Tuple[Tuple[str, Optional[str], int], ...] = ()
+
+    @property
+    def note_ids(self) -> Tuple[str, ...]:
+        return (self.note_id,)
+
+    def with_file_ids(self, file_ids: Dict[Optional[str], str]) -> "UploadRecord":
+        """The record with the ids of its newly uploaded file or chunks filled in."""
+        return self._replace(
+            file_id=file_ids.get(None),
+            chunks=tuple((h, file_id or file_ids[h], size) for h, file_id, size in self.chunks))
+
+class BundleRecord(NamedTuple):
+    """A vector store file packing the sections of several small notes."""
+    bundle_id: str
+    file_id: Optional[str]
+    # The record of each packed note, with the compressed section it contributes to the bundle
+    members: Tuple[Tuple[UploadRecord, bytes], ...]
+
+    @property
+    def note_ids(self) -> Tuple[str, ...]:
+        return tuple(member.note_id for member, _ in self.members)
+
+    def with_file_ids(self, file_ids: Dict[Optional[str], str]) -> "BundleRecord":
+        return self._replace(file_id=file_ids[None])
+
+# The record of a single note or of a bundle of packed notes
+NoteFileRecord = Union[UploadRecord, BundleRecord]
+
+# A serialized note or bundle waiting for upload: its record and the (file name, content) of each file to
+# upload, keyed by chunk hash, or by None for a note or bundle uploaded as a single file
+StagedNote = Tuple[NoteFileRecord, Dict[Optional[str], Tuple[str, bytes]]]
+
+class SyncState:
+    """Per-note sync state kept in an indexed SQLite database so lookups and writes do not scale with library size."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path or STATE_FILE, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        # note_id -> (updated, hash), loaded on first use
+        self._versions: Optional[Dict[str, Tuple[Optional[str], str]]] = None
+
+    def migrate(self) -> None:
+        """Bring the database schema up to date."""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(STATE_MIGRATIONS[version:], version + 1):
+            with self.conn:
+                self.conn.executescript(migration)
+                self.conn.execute(f"PRAGMA user_version = {number}")
+
+    def partition(self, notes: Iterable[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """
+        Split notes by whether their content has already been uploaded for the same note.
+
+        A note is unchanged only if its own recorded hash matches, so two notes with the same content
+        are tracked separately.
+
+        Returns:
+            Tuple[List[Dict[str, str]], List[Dict[str, str]]]: The new or updated notes and the unchanged notes.
+        """
+        versions = self.versions
+        new_notes: List[Dict[str, str]] = []
+        unchanged_notes: List[Dict[str, str]] = []
+        for note in notes:
+            recorded = versions.get(note['id'])
+            (unchanged_notes if recorded is not None and recorded[1] == note['hash'] else new_notes).append(note)
+        return new_notes, unchanged_notes
+
+    @property
+    def versions(self) -> Dict[str, Tuple[Optional[str], str]]:
+        """The modification date and hash last recorded for each note id."""
+        if self._versions is None:
+            with self.lock:
+                rows = self.conn.execute("SELECT note_id, updated, hash FROM notes")
+                self._versions = {note_id: (updated, note_hash) for note_id, updated, note_hash in rows}
+        return self._versions
+
+    def known_hash(self, note: Dict[str, str]) -> Optional[str]:
+        """The stored hash of a note if its modification date is unchanged since that hash was recorded."""
+        updated, note_hash = self.versions.get(note['id'], (None, None))
+        return note_hash if updated and updated == note.get('updated') else None
+
+    def record_unchanged(self, notes: List[Dict[str, str]]) -> None:
+        """
+        Refresh the modification date of re-hashed notes whose content did not change, so the next
+        sync can skip hashing them.
+        """
+        notes = [note for note in notes if not note.get('unchanged')]
+        if not notes:
+            return
+        with self.lock, self.conn:
+            for note in notes:
+                if self.conn.execute("UPDATE notes SET updated = ? WHERE note_id = ? AND hash = ?",
+                                     (note.get('updated'), note['id'], note['hash'])).rowcount and self._versions is not None:
+                    self._versions[note['id']] = (note.get('updated'), note['hash'])
+
+    def note_ids(self) -> Set[str]:
+        with self.lock:
+            return {note_id for (note_id,) in self.conn.execute("SELECT note_id FROM notes")}
+
+    def chunk_files(self, note_id: str) -> Dict[str, Tuple[str, int]]:
+        """The file id and size of each chunk already uploaded for a note, keyed by chunk hash."""
+        with self.lock:
+            rows = self.conn.execute("SELECT hash, file_id, size FROM chunks WHERE note_id = ?", (note_id,))
+            return {chunk_hash: (file_id, size) for chunk_hash, file_id, size in rows}
+
+    def mark_stale(self, file_ids: Iterable[str]) -> None:
+        """Queue files that are not tracked by any note for deletion from the vector store."""
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO stale_files (file_id) VALUES (?)", ((file_id,) for file_id in file_ids))
+
+    def begin_uploads(self, filenames: Iterable[str]) -> None:
+        """Journal files before uploading them, so uploads cut short by a crash can be found afterwards."""
+        started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO pending_uploads (filename, started_at) VALUES (?, ?)",
+                                  ((filename, started_at) for filename in filenames))
+
+    def pending_uploads(self) -> Set[str]:
+        with self.lock:
+            return {filename for (filename,) in self.conn.execute("SELECT filename FROM pending_uploads")}
+
+    def end_uploads(self, filenames: Iterable[str]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM pending_uploads WHERE filename = ?", ((filename,) for filename in filenames))
+
+    def record_uploads(self, records: List[NoteFileRecord], filenames: Iterable[str] = (), batch_id: Optional[str] = None) -> None:
+        """
+        Record uploaded notes and bundles in a single transaction, clearing their files from the upload journal.
+
+        Any file or chunk previously uploaded for the same note and not part of the new version is
+        queued in stale_files for deletion once batch_id, the file batch holding the new version, has
+        finished indexing. A note uploaded on its own leaves the bundle it was packed in, which is
+        marked dirty so it gets rebuilt without it; the same goes for notes moving to another bundle,
+        and a bundle they leave empty is dropped.
+        """
+        bundles = [record for record in records if isinstance(record, BundleRecord)]
+        singles = [record for record in records if isinstance(record, UploadRecord)]
+        uploads = singles + [member for bundle in bundles for member, _ in bundle.members]
+        uploaded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM pending_uploads WHERE filename = ?", ((filename,) for filename in filenames))
+            self.conn.executemany(
+                "UPDATE bundles SET dirty = 1 WHERE bundle_id = (SELECT bundle_id FROM bundle_members WHERE note_id = ?)",
+                ((upload.note_id,) for upload in singles))
+            self.conn.executemany("DELETE FROM bundle_members WHERE note_id = ?", ((upload.note_id,) for upload in singles))
+            for bundle in bundles:
+                previous = {bundle_id for member, _ in bundle.members for (bundle_id,) in self.conn.execute(
+                    "SELECT bundle_id FROM bundle_members WHERE note_id = ?", (member.note_id,))} - {bundle.bundle_id}
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO stale_files (file_id, batch_id) "
+                    "SELECT file_id, ? FROM bundles WHERE bundle_id = ? AND file_id IS NOT NULL AND file_id IS NOT ?",
+                    (batch_id, bundle.bundle_id, bundle.file_id))
+                self.conn.execute("INSERT OR REPLACE INTO bundles (bundle_id, file_id, size, dirty) VALUES (?, ?, ?, 0)",
+                                  (bundle.bundle_id, bundle.file_id, sum(member.size for member, _ in bundle.members)))
+                self.conn.execute("DELETE FROM bundle_members WHERE bundle_id = ?", (bundle.bundle_id,))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO bundle_members (note_id, bundle_id, content) VALUES (?, ?, ?)",
+                    ((member.note_id, bundle.bundle_id, content) for member, content in bundle.members))
+                for bundle_id in previous:
+                    # A bundle a note moved out of still holds its old version, so it is rebuilt or dropped
+                    if self.conn.execute("SELECT 1 FROM bundle_members WHERE bundle_id = ?", (bundle_id,)).fetchone():
+                        self.conn.execute("UPDATE bundles SET dirty = 1 WHERE bundle_id = ?", (bundle_id,))
+                        continue
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO stale_files (file_id, batch_id) "
+                        "SELECT file_id, ? FROM bundles WHERE bundle_id = ? AND file_id IS NOT NULL", (batch_id, bundle_id))
+                    self.conn.execute("DELETE FROM bundles WHERE bundle_id = ?", (bundle_id,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO stale_files (file_id, batch_id) "
+                "SELECT file_id, ? FROM notes WHERE note_id = ? AND file_id IS NOT NULL AND file_id IS NOT ?",
+                ((batch_id, upload.note_id, upload.file_id) for upload in uploads))
+            for upload in uploads:
+                kept = {file_id for _, file_id, _ in upload.chunks}
+                for (file_id,) in self.conn.execute("SELECT file_id FROM chunks WHERE note_id = ?", (upload.note_id,)).fetchall():
+                    if file_id not in kept:
+                        self.conn.execute("INSERT OR IGNORE INTO stale_files (file_id, batch_id) VALUES (?, ?)", (file_id, batch_id))
+                self.conn.execute("DELETE FROM chunks WHERE note_id = ?", (upload.note_id,))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (note_id, hash, file_id, size) VALUES (?, ?, ?, ?)",
+                    ((upload.note_id, chunk_hash, file_id, size) for chunk_hash, file_id, size in upload.chunks))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO notes (note_id, hash, file_id, uploaded_at, size, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                ((upload.note_id, upload.hash, upload.file_id, uploaded_at, upload.size, upload.updated) for upload in uploads))
+        if self._versions is not None:
+            self._versions.update((upload.note_id, (upload.updated, upload.hash)) for upload in uploads)
+
+    def forget_notes(self, note_ids: Iterable[str]) -> None:
+        """Remove notes that no longer exist in Apple Notes, queueing their files in stale_files for deletion."""
+        note_ids = [(note_id,) for note_id in note_ids]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO stale_files (file_id) SELECT file_id FROM notes WHERE note_id = ? AND file_id IS NOT NULL",
+                note_ids)
+            self.conn.executemany("INSERT OR IGNORE INTO stale_files (file_id) SELECT file_id FROM chunks WHERE note_id = ?", note_ids)
+            self.conn.executemany("DELETE FROM chunks WHERE note_id = ?", note_ids)
+            self.conn.executemany(
+                "UPDATE bundles SET dirty = 1 WHERE bundle_id = (SELECT bundle_id FROM bundle_members WHERE note_id = ?)",
+                note_ids)
+            self.conn.executemany("DELETE FROM bundle_members WHERE note_id = ?", note_ids)
+            self.conn.executemany("DELETE FROM notes WHERE note_id = ?", note_ids)
+        self._versions = None
+
+    def add_upload_batch(self, batch_id: str, file_count: int) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO upload_batches (batch_id, created_at, file_count) VALUES (?, ?, ?)",
+                              (batch_id, datetime.now(timezone.utc).isoformat(timespec="seconds"), file_count))
+
+    def upload_batches(self) -> List[Tuple[str, int]]:
+        """The id and file count of every file batch that has not been seen to finish indexing."""
+        with self.lock:
+            return self.conn.execute("SELECT batch_id, file_count FROM upload_batches ORDER BY created_at").fetchall()
+
+    def finish_upload_batch(self, batch_id: str) -> None:
+        """Stop tracking a file batch that is done indexing, releasing the stale files it replaced for deletion."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM upload_batches WHERE batch_id = ?", (batch_id,))
+            self.conn.execute("UPDATE stale_files SET batch_id = NULL WHERE batch_id = ?", (batch_id,))
+
+    def requeue_files(self, file_ids: Iterable[str]) -> Set[str]:
+        """
+        Forget the notes owning files that failed to index and queue them in requeued_notes, so the next upload sends them again.
+
+        Returns:
+            Set[str]: The ids of the forgotten notes.
+        """
+        file_ids = [(file_id,) for file_id in file_ids]
+        with self.lock:
+            note_ids = {note_id for query in (
+                "SELECT note_id FROM notes WHERE file_id = ?",
+                "SELECT note_id FROM chunks WHERE file_id = ?",
+                "SELECT m.note_id FROM bundle_members m JOIN bundles b ON b.bundle_id = m.bundle_id WHERE b.file_id = ?",
+            ) for file_id in file_ids for (note_id,) in self.conn.execute(query, file_id)}
+        self.forget_notes(note_ids)
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO requeued_notes (note_id) VALUES (?)", ((note_id,) for note_id in note_ids))
+        return note_ids
+
+    def requeued_note_ids(self) -> Set[str]:
+        with self.lock:
+            return {note_id for (note_id,) in self.conn.execute("SELECT note_id FROM requeued_notes")}
+
+    def clear_requeued(self, note_ids: Iterable[str]) -> None:
+        """Stop tracking requeued notes that have been extracted and uploaded again, or deleted from Apple Notes."""
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM requeued_notes WHERE note_id = ?", ((note_id,) for note_id in note_ids))
+
+    def bundle_ids(self, note_ids: Iterable[str]) -> Set[str]:
+        """The bundles the given notes are packed in."""
+        with self.lock:
+            return {bundle_id for note_id in note_ids for (bundle_id,) in
+                    self.conn.execute("SELECT bundle_id FROM bundle_members WHERE note_id = ?", (note_id,))}
+
+    def mark_bundles_dirty(self, bundle_ids: Iterable[str]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE bundles SET dirty = 1 WHERE bundle_id = ?", ((bundle_id,) for bundle_id in bundle_ids))
+
+    def dirty_bundle_ids(self) -> Set[str]:
+        with self.lock:
+            return {bundle_id for (bundle_id,) in self.conn.execute("SELECT bundle_id FROM bundles WHERE dirty = 1")}
+
+    def bundle_members(self, bundle_id: str) -> List[Tuple[UploadRecord, bytes]]:
+        """The record and compressed section of every note currently packed in a bundle."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT n.note_id, n.hash, n.size, n.updated, m.content FROM bundle_members m "
+                "JOIN notes n ON n.note_id = m.note_id WHERE m.bundle_id = ?", (bundle_id,)).fetchall()
+        return [(UploadRecord(note_id, note_hash, None, size, updated), content)
+                for note_id, note_hash, size, updated, content in rows]
+
+    def drop_bundles(self, bundle_ids: Iterable[str]) -> None:
+        """Forget bundles left without members, queueing their files in stale_files for deletion."""
+        bundle_ids = [(bundle_id,) for bundle_id in bundle_ids]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO stale_files (file_id) SELECT file_id FROM bundles WHERE bundle_id = ? AND file_id IS NOT NULL",
+                bundle_ids)
+            self.conn.executemany("DELETE FROM bundle_members WHERE bundle_id = ?", bundle_ids)
+            self.conn.executemany("DELETE FROM bundles WHERE bundle_id = ?", bundle_ids)
+
+    def stale_file_ids(self) -> List[str]:
+        """Stale files ready for deletion, leaving out those whose replacement is still being indexed."""
+        with self.lock:
+            return [file_id for (file_id,) in self.conn.execute("SELECT file_id FROM stale_files WHERE batch_id IS NULL")]
+
+    def discard_stale_files(self, file_ids: Iterable[str]) -> None:
+        """Stop tracking stale files that have been deleted from the vector store."""
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM stale_files WHERE file_id = ?", ((file_id,) for file_id in file_ids))
+
+    def add_baseline_files(self, file_ids: Iterable[str]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO baseline_files (file_id) VALUES (?)", ((file_id,) for file_id in file_ids))
+
+    def release_baseline_files(self) -> int:
+        """
+        Queue baseline files that no note, chunk or bundle tracks in stale_files for deletion.
+
+        Returns:
+            int: The number of files queued.
+        """
+        with self.lock, self.conn:
+            queued = self.conn.execute(
+                "INSERT OR IGNORE INTO stale_files (file_id) SELECT file_id FROM baseline_files WHERE file_id NOT IN ("
+                "SELECT file_id FROM notes WHERE file_id IS NOT NULL UNION SELECT file_id FROM chunks "
+                "UNION SELECT file_id FROM bundles WHERE file_id IS NOT NULL)").rowcount
+            self.conn.execute("DELETE FROM baseline_files")
+        return queued
+
+class TokenBucket:
+    """A budget that refills continuously at the rate implied by the last x-ratelimit-* headers seen."""
+
+    def __init__(self) -> None:
+        # No limit is known until a response reports one
+        self.limit: Optional[float] = None
+        self.remaining = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.limit is not None:
+            self.remaining = min(self.limit, self.remaining + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float, now: float) -> float:
+        """Take cost from the budget, returning how long to wait until the budget covers it."""
+        self.refill(now)
+        if self.limit is None or cost <= 0:
+            return 0.0
+        self.remaining -= cost
+        if self.remaining >= 0:
+            return 0.0
+        return -self.remaining / self.rate if self.rate else RETRY_MAX_DELAY
+
+    def observe(self, limit: Optional[str], remaining: Optional[str], reset: Optional[str], now: float) -> None:
+        """Resynchronize with the limit, remaining budget and time until full budget reported by the API."""
+        if limit is None or remaining is None:
+            return
+        try:
+            limit_value, remaining_value = float(limit), float(remaining)
+        except ValueError:
+            return
+        self.refill(now)
+        # Requests reserved since the server took its snapshot are not in its count, so the lower figure wins
+        self.remaining = remaining_value if self.limit is None else min(self.remaining, remaining_value)
+        self.limit = limit_value
+        reset_seconds = parse_reset_duration(reset)
+        self.rate = (limit_value - remaining_value) / reset_seconds if reset_seconds else limit_value
+
+def parse_reset_duration(value: Optional[str]) -> float:
+    """Parse an x-ratelimit-reset-* duration such as "20ms", "1.5s" or "6m0s" into seconds."""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value or ""))
+
+class RateLimiter:
+    """
+    Client-side throttle shared by every OpenAI request the assistant makes.
+
+    Requests and estimated tokens are drawn from token buckets kept in step with the
+    x-ratelimit-* response headers, a 429 pauses every request until its Retry-After or reset time,
+    and the upload concurrency limit backs off multiplicatively on 429s and grows additively on
+    success. The limiter is attached to the sync and async HTTP clients through event hooks.
+    """
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.lock = threading.Lock()
+        self.buckets = {"requests": TokenBucket(), "tokens": TokenBucket()}
+        self.paused_until = 0.0
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        with self.lock:
+            if max_concurrency > self.max_concurrency:
+                # A higher limit, such as a larger --concurrency, applies at once rather than being grown back to
+                self.concurrency = float(max_concurrency)
+            else:
+                self.concurrency = min(self.concurrency, max_concurrency)
+            self.max_concurrency = max_concurrency
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(1, int(self.concurrency))
+
+    def delay(self, request: httpx.Request) -> float:
+        """Reserve budget for a request and return how long it has to wait before being sent."""
+        tokens = 0
+        if request.headers.get("content-type", "").startswith("application/json"):
+            tokens = len(request.content) // BYTES_PER_TOKEN
+        now = time.monotonic()
+        with self.lock:
+            wait = max(self.buckets["requests"].reserve(1, now), self.buckets["tokens"].reserve(tokens, now))
+            return max(wait, self.paused_until - now)
+
+    def observe(self, response: httpx.Response) -> None:
+        """Update the budgets and concurrency limit from a response."""
+        headers = response.headers
+        now = time.monotonic()
+        with self.lock:
+            for name, bucket in self.buckets.items():
+                bucket.observe(headers.get(f"x-ratelimit-limit-{name}"), headers.get(f"x-ratelimit-remaining-{name}"),
+                               headers.get(f"x-ratelimit-reset-{name}"), now)
+            if response.status_code == 429:
+                retry_after = headers.get("retry-after", "")
+                pause = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else max(
+                    parse_reset_duration(headers.get("x-ratelimit-reset-requests")),
+                    parse_reset_duration(headers.get("x-ratelimit-reset-tokens")), RETRY_BASE_DELAY)
+                self.paused_until = max(self.paused_until, now + pause)
+                self.concurrency = max(1.0, self.concurrency / 2)
+            elif response.status_code < 400:
+                # Grows by about one slot per round of concurrent requests
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+
+    def http_client(self) -> httpx.Client:
+        """An HTTP client for OpenAI whose requests are throttled by this limiter."""
+        def before(request: httpx.Request) -> None:
+            time.sleep(self.delay(request))
+        return DefaultHttpxClient(event_hooks={"request": [before], "response": [self.observe]})
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        """An async HTTP client for AsyncOpenAI whose requests are throttled by this limiter."""
+        async def before(request: httpx.Request) -> None:
+            await asyncio.sleep(self.delay(request))
+        async def after(response: httpx.Response) -> None:
+            self.observe(response)
+        return DefaultAsyncHttpxClient(event_hooks={"request": [before], "response": [after]})
+
+class AdaptiveSemaphore:
+    """An asyncio semaphore whose number of slots follows the rate limiter's current concurrency limit."""
+
+    def __init__(self, limiter: RateLimiter) -> None:
+        self.limiter = limiter
+        self.active = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limiter.concurrency_limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
 class NotesAssistantConfig:
     def __init__(self) -> None:
         self.config: Dict[str, Optional[str]] = self.load_config()
+        self._state: Optional[SyncState] = None
+        # Nesting depth of batch_updates blocks, and whether an update inside them still needs saving
+        self._batch_depth = 0
+        self._dirty = False
 
     def load_config(self) -> Dict[str, Optional[str]]:
         """Load configuration from file or return default configuration."""
@@ -54,18 +1029,57 @@ class NotesAssistantConfig:
                     return json.load(f)
             except json.JSONDecodeError:
                 typer.echo("Error decoding the config file. Loading default configuration.")
-        return {"assistant_id": None, "vector_store_id": None, "thread_id": None, "embedded_notes": [],
-                "openai_api_key": None}
+        return {"assistant_id": None, "vector_store_id": None, "thread_id": None, "openai_api_key": None}
 
     def save_config(self) -> None:
-        """Save current configuration to file."""
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(self.config, f)
+        """
+        Save current configuration to file atomically.
+
+        The configuration is written to a temporary file in the same directory, flushed to disk and
+        renamed over the old file, so a crash leaves either the old or the new file intact.
+        """
+        config_dir = os.path.dirname(CONFIG_FILE) or "."
+        fd, temp_path = tempfile.mkstemp(dir=config_dir, prefix=".chat_apple_notes_config.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.config, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, CONFIG_FILE)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._dirty = False
+        # Persist the rename itself; not every platform lets a directory be opened for this
+        try:
+            dir_fd = os.open(config_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
 
     def update_config(self, **kwargs: str) -> None:
-        """Update configuration with provided key-value pairs."""
+        """Update configuration with provided key-value pairs, deferring the write inside batch_updates."""
         self.config.update(kwargs)
-        self.save_config()
+        if self._batch_depth:
+            self._dirty = True
+        else:
+            self.save_config()
+
+    @contextmanager
+    def batch_updates(self) -> Iterator[None]:
+        """Coalesce every update_config call made inside the block into a single write when it exits."""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._dirty:
+                self.save_config()
 
     @property
     def assistant_id(self) -> Optional[str]:
@@ -80,8 +1094,16 @@ class NotesAssistantConfig:
         return self.config["thread_id"]
 
     @property
-    def embedded_notes(self) -> set:
-        return set(self.config.get("embedded_notes", []))
+    def state(self) -> SyncState:
+        """The sync state database, opened on first use so commands that never sync do not touch it."""
+        if self._state is None:
+            self._state = SyncState()
+            self.migrate_embedded_notes()
+        return self._state
+
+    def partition(self, notes: Iterable[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Split notes into new or updated notes and notes whose content has already been uploaded."""
+        return self.state.partition(notes)
 
     @property
     def openai_api_key(self) -> Optional[str]:
@@ -91,19 +1113,57 @@ class NotesAssistantConfig:
     def disk_privileges(self) -> bool:
         return self.config.get("disk_privileges", False)
 
-    def add_embedded_notes(self, note_hashes: List[str]) -> None:
-        """Add new note hashes to the list of embedded notes."""
-        self.config["embedded_notes"] = list(set(self.config.get("embedded_notes", []) + note_hashes))
+    @property
+    def extraction_backend(self) -> str:
+        return self.config.get("extraction_backend") or "osascript"
+
+    @property
+    def extraction_workers(self) -> int:
+        return self.config.get("extraction_workers") or DEFAULT_EXTRACTION_WORKERS
+
+    @property
+    def pack_notes(self) -> bool:
+        return self.config.get("pack_notes", False)
+
+    @property
+    def upload_concurrency(self) -> int:
+        return self.config.get("upload_concurrency") or DEFAULT_UPLOAD_CONCURRENCY
+
+    @property
+    def upload_batch_size(self) -> int:
+        return self.config.get("upload_batch_size") or DEFAULT_UPLOAD_BATCH_SIZE
+
+    @property
+    def list_baseline_files(self) -> bool:
+        return self.config.get("list_baseline_files", False)
+
+    @property
+    def last_sync(self) -> Optional[datetime]:
+        last_sync = self.config.get("last_sync")
+        return datetime.fromisoformat(last_sync) if last_sync else None
+
+    def migrate_embedded_notes(self) -> None:
+        """Drop the config file's embedded_notes list and upload every note again, tracked by the sync state database."""
+        if "embedded_notes" not in self.config:
+            return
+        # The listed hashes predate the current hash format and were never tied to note ids, so they cannot be matched
+        self.config.pop("embedded_notes")
+        self.config["last_sync"] = None
+        # The files uploaded so far are listed by the next upload, before it adds any, so they can be deleted once replaced
+        self.config["list_baseline_files"] = True
         self.save_config()
 
 class NotesAssistant:
     def __init__(self) -> None:
         """Initialize the NotesAssistant with configuration and OpenAI client."""
         self.config = NotesAssistantConfig()
-        self.setup_api_key()
-        self.setup_disk_privileges()
-        self.client = OpenAI(api_key=self.config.openai_api_key)
-        self.setup_assistant_and_vector_store()
+        self.last_batch_check = float("-inf")
+        self.rate_limiter = RateLimiter(self.config.upload_concurrency)
+        with self.config.batch_updates():
+            self.setup_api_key()
+            self.setup_disk_privileges()
+            self.client = OpenAI(api_key=self.config.openai_api_key, http_client=self.rate_limiter.http_client())
+            self.setup_assistant_and_vector_store()
 
     def setup_api_key(self) -> None:
         """Set up the OpenAI API key, prompting the user if necessary."""
@@ -135,103 +1195,854 @@ class NotesAssistant:
             )
             self.config.update_config(assistant_id=assistant.id, vector_store_id=vector_store.id)
 
-    def get_real_identifier(self, coredata_url: str) -> Optional[str]:
+    @contextmanager
+    def open_note_store(self) -> Iterator[sqlite3.Connection]:
+        """Open a read-only connection to the Apple Notes database."""
         try:
-            internal_db_id = coredata_url.split('/')[-1].lstrip('p')
-            db_path = os.path.expanduser('~/Library/Group Containers/group.com.apple.notes/NoteStore.sqlite')
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT ZIDENTIFIER FROM ZICCLOUDSYNCINGOBJECT WHERE Z_PK=?", (internal_db_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result[0] if result else None
+            conn = sqlite3.connect(f"file:{quote(NOTE_STORE_PATH)}?mode=ro", uri=True)
+            # Access is only checked once the file is actually read
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1")
         except sqlite3.OperationalError as e:
             if "unable to open database file" in str(e):
                 raise DiskAccessError("Please either grant terminal disk access privileges or use update-privileges to turn off privileges in the app.") from e
             raise
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_real_identifiers(self, conn: sqlite3.Connection, coredata_urls: List[str]) -> Dict[str, Optional[str]]:
+        """Map Core Data note URLs to the identifiers used in notes:// links, in as few queries as possible."""
+        internal_db_ids = {url: url.split('/')[-1].lstrip('p') for url in coredata_urls}
+        unique_ids = list(set(internal_db_ids.values()))
+        identifiers: Dict[str, str] = {}
+        for chunk in batched(unique_ids, REAL_ID_BATCH_SIZE):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT Z_PK, ZIDENTIFIER FROM ZICCLOUDSYNCINGOBJECT WHERE Z_PK IN ({placeholders})", chunk)
+            identifiers.update((str(pk), identifier) for pk, identifier in rows)
+        return {url: identifiers.get(internal_db_id) for url, internal_db_id in internal_db_ids.items()}
+
+    def with_real_identifiers(self, notes: Iterable[Dict[str, str]]) -> Generator[Dict[str, str], None, None]:
+        """Resolve real identifiers for a stream of notes in batches over a single database connection."""
+        with self.open_note_store() as conn:
+            for batch in batched(notes, REAL_ID_BATCH_SIZE):
+                identifiers = self.get_real_identifiers(conn, [note['id'] for note in batch])
+                for note in batch:
+                    note["real_id"] = identifiers[note['id']]
+                yield from batch
 
-    def extract_notes(self) -> Generator[Dict[str, str], None, None]:
+    def hash_note(self, note: Dict[str, str]) -> str:
+        """Hash the content of a note for change detection."""
+        return hashlib.sha256(f"{note['title']}{note['body']}".encode()).hexdigest()
+
+    def prepare_note(self, note: Dict[str, str], html: bool, reuse_hashes: bool) -> Dict[str, str]:
+        """
+        Add the content hash and a default link identifier to an extracted note.
+
+        Args:
+            note (Dict[str, str]): The extracted note.
+            html (bool): Whether the body is Notes.app HTML that needs converting to text first.
+            reuse_hashes (bool): If True, notes whose modification date matches the sync state reuse the
+                stored hash and are marked unchanged without normalizing or hashing their body.
+        """
+        note.setdefault("real_id", note['id'])
+        known_hash = self.config.state.known_hash(note) if reuse_hashes else None
+        if known_hash:
+            note["hash"] = known_hash
+            note["unchanged"] = True
+            return note
+        if html:
+            note["body"] = html_to_text(note["body"])
+        note["hash"] = self.hash_note(note)
+        return note
+
+    def resolve_backend(self, backend: Optional[str] = None) -> str:
+        """Validate the requested extraction backend, falling back to the configured one."""
+        backend = backend or self.config.extraction_backend
+        if backend not in EXTRACTION_BACKENDS:
+            raise ValueError(f"Unknown extraction backend '{backend}'. Choose one of: {', '.join(EXTRACTION_BACKENDS)}")
+        return backend
+
+    def extract_notes(self, backend: Optional[str] = None, since: Optional[datetime] = None, workers: Optional[int] = None,
+                      reuse_hashes: bool = False, note_ids: Optional[Set[str]] = None) -> Generator[Dict[str, str], None, None]:
         """
-        Extract notes from Apple Notes application.
+        Extract notes from Apple Notes using the configured extraction backend.
+
+        Args:
+            backend (Optional[str]): One of EXTRACTION_BACKENDS. Defaults to the configured backend.
+            since (Optional[datetime]): If provided, only extract notes modified after this time.
+            workers (Optional[int]): Number of concurrent osascript processes for the parallel backend.
+            reuse_hashes (bool): If True, skip hashing notes whose modification date matches the sync state.
+            note_ids (Optional[Set[str]]): If provided, only extract the notes with these ids instead of filtering by since.
 
         Yields:
             Dict[str, str]: A dictionary containing note information.
         """
+        backend = self.resolve_backend(backend)
+        if note_ids is not None:
+            # Notes picked by id cannot be addressed by index range, so the bulk and parallel backends read them through osascript
+            notes = self.extract_notes_sqlite(note_ids=note_ids) if backend == "sqlite" else self.extract_notes_osascript(note_ids=note_ids)
+        else:
+            extract = getattr(self, f"extract_notes_{backend}")
+            notes = extract(since, workers) if backend == "parallel" else extract(since)
+        notes = (self.prepare_note(note, backend != "sqlite", reuse_hashes) for note in notes)
+        if self.config.disk_privileges and backend != "sqlite":
+            notes = self.with_real_identifiers(notes)
+        yield from notes
+
+    def list_note_ids(self, backend: Optional[str] = None) -> Set[str]:
+        """Fetch the ids of every note without reading any note content."""
+        if self.resolve_backend(backend) == "sqlite":
+            with self.open_note_store() as conn:
+                store_uuid = conn.execute("SELECT Z_UUID FROM Z_METADATA").fetchone()[0]
+                rows = conn.execute(
+                    "SELECT Z_PK FROM ZICCLOUDSYNCINGOBJECT WHERE ZNOTEDATA IS NOT NULL AND IFNULL(ZMARKEDFORDELETION, 0) = 0 AND IFNULL(ZISPASSWORDPROTECTED, 0) = 0")
+                return {f"x-coredata://{store_uuid}/ICNote/p{pk}" for (pk,) in rows}
+        output = subprocess.check_output(["osascript", "-e", NOTE_IDS_SCRIPT]).decode("utf-8").strip()
+        return set(output.split(", ")) if output else set()
+
+    def extract_notes_osascript(self, since: Optional[datetime] = None,
+                                note_ids: Optional[Set[str]] = None) -> Generator[Dict[str, str], None, None]:
+        """Extract notes, or only the notes with the given ids, by driving Notes.app through osascript."""
         split = secrets.token_hex(8)
+        prelude, note_filter = note_selection(since)
+        notes = f"(every note{note_filter})"
+        if note_ids is not None:
+            prelude, notes = "", "{" + ", ".join(f'note id "{note_id}"' for note_id in sorted(note_ids)) + "}"
         process = subprocess.Popen(
-            ["osascript", "-e", EXTRACT_SCRIPT.format(split=split)],
+            ["osascript", "-e", EXTRACT_SCRIPT.format(split=split, prelude=prelude, notes=notes)],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
         )
-        note: Dict[str, str] = {}
-        body: List[str] = []
+        messages: List[str] = []
+        frames = read_frames(process.stdout, split, messages)
+
+        # The script reports the number of notes before the first note
+        total_notes = next((int(value) for key, value in frames if key == "count"), 0)
+
+        note_count = 0
+        with typer.progressbar(length=total_notes, label="Parsing notes") as progress:
+            for note_count, note in enumerate(parse_note_frames(frames), 1):
+                yield note
+                progress.update(1)
+                progress.label = f"Parsing note {note_count} of {total_notes}"
+        finish_extraction(process, messages, note_count, total_notes)
 
-        # Get total number of notes
+    def extract_notes_parallel(self, since: Optional[datetime] = None,
+                               workers: Optional[int] = None) -> Generator[Dict[str, str], None, None]:
+        """
+        Extract notes with a bounded pool of osascript processes, each walking its own index range of notes.
+
+        Index ranges rather than folders are used so that nested folders and unevenly sized folders
+        neither drop notes nor leave a single worker with most of the library. Notes added or deleted
+        during the run shift the ranges, so a note seen twice is yielded once and the run fails with
+        ExtractionError unless every counted note was seen.
+        """
+        workers = workers or self.config.extraction_workers
+        prelude, note_filter = note_selection(since)
+        # The ranges have to be planned before any worker starts, so this is the one count that blocks
         total_notes = int(
-            subprocess.check_output(["osascript", "-e", 'tell application "Notes" to get count of notes']).strip())
+            subprocess.check_output(["osascript", "-e", COUNT_SCRIPT.format(prelude=prelude, filter=note_filter)]).strip())
+        if note_filter:
+            # A filtered selection cannot be addressed by index range, so it is walked by a single worker
+            shards = [f"(every note{note_filter})"]
+        else:
+            shard_size = max(1, math.ceil(total_notes / (workers * PARALLEL_SHARDS_PER_WORKER)))
+            shards = [f"(notes {start} thru {min(start + shard_size - 1, total_notes)})"
+                      for start in range(1, total_notes + 1, shard_size)]
+
+        results: queue.Queue = queue.Queue(maxsize=PARALLEL_QUEUE_SIZE)
+        stop = threading.Event()
+        processes: List[subprocess.Popen] = []
+        shard_done = object()
+
+        def put(item: Any) -> bool:
+            return queue_put(results, item, stop)
+
+        def run_shard(notes: str) -> None:
+            try:
+                if stop.is_set():
+                    return
+                split = secrets.token_hex(8)
+                process = subprocess.Popen(
+                    ["osascript", "-e", EXTRACT_SCRIPT.format(split=split, prelude=prelude, notes=notes)],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+                processes.append(process)
+                messages: List[str] = []
+                for note in parse_note_frames(read_frames(process.stdout, split, messages)):
+                    if not put(note):
+                        return
+                process.wait()
+                if process.returncode:
+                    detail = f": {messages[-1]}" if messages else ""
+                    raise ExtractionError(f"osascript exited with status {process.returncode} reading {notes}{detail}")
+            except Exception as e:
+                put(e)
+            finally:
+                put(shard_done)
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for notes in shards:
+                pool.submit(run_shard, notes)
+            with typer.progressbar(length=total_notes, label="Parsing notes") as progress:
+                remaining, seen_ids = len(shards), set()
+                while remaining:
+                    item = results.get()
+                    if item is shard_done:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    elif item['id'] not in seen_ids:
+                        seen_ids.add(item['id'])
+                        yield item
+                        progress.update(1)
+                        progress.label = f"Parsing note {len(seen_ids)} of {total_notes}"
+            if len(seen_ids) != total_notes:
+                raise ExtractionError(f"Extracted {len(seen_ids)} notes but Notes counted {total_notes}")
+        finally:
+            stop.set()
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+            pool.shutdown(wait=True)
+
+    def extract_notes_bulk(self, since: Optional[datetime] = None) -> Generator[Dict[str, str], None, None]:
+        """
+        Extract notes with one Apple Event per property per chunk of notes instead of per note.
+
+        The script logs each property list of a chunk in turn and the lists are zipped back into notes here.
+        Folder ids are fetched once per folder up front, since container cannot be read for a range of notes.
+
+        Raises:
+            ExtractionError: If the notes changed while a chunk was read, so its lists no longer line up,
+                or a note was read twice because notes shifted between chunks.
+        """
+        split = secrets.token_hex(8)
+        prelude, note_filter = note_selection(since)
+        if note_filter:
+            # A filtered selection cannot be addressed by index range, so it is read as a single chunk
+            chunk, chunk_size = f"(every note{note_filter})", "noteCount + 1"
+        else:
+            chunk, chunk_size = "notes chunkStart thru chunkEnd", BULK_CHUNK_SIZE
+        script = BULK_EXTRACT_SCRIPT.format(split=split, prelude=prelude, filter=note_filter, chunk=chunk, chunk_size=chunk_size)
+        process = subprocess.Popen(
+            ["osascript", "-e", script],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        messages: List[str] = []
+        frames = read_frames(process.stdout, split, messages)
+        keys = ("id", "title", "created", "updated", "body")
+        chunk: Dict[str, List[str]] = {key: [] for key in (*keys, "check")}
+        folders: Dict[str, str] = {}
+        seen_ids: Set[str] = set()
+
+        total_notes = 0
+        for key, value in frames:
+            if key == "count":
+                total_notes = int(value)
+                break
 
         with typer.progressbar(length=total_notes, label="Parsing notes") as progress:
-            note_count = 1
-            for line in process.stdout:
-                line = line.decode("mac_roman").strip()
-                if line == f"{split}{split}":
-                    if note.get("id"):
-                        note["body"] = "\n".join(body).strip()
-                        note["hash"] = hashlib.sha256(f"{note['title']}{note['body']}".encode()).hexdigest()
-                        if self.config.disk_privileges:
-                            try:
-                                note["real_id"] = self.get_real_identifier(note['id'])
-                            except DiskAccessError as e:
-                                typer.echo(f"\nError: {str(e)}")
-                                return
-                        else:
-                            note["real_id"] = note['id']
+            note_count = 0
+            for key, value in frames:
+                if key == "end":
+                    # The properties come from separate Apple Events, so they only line up if the notes did not change in between
+                    if any(len(chunk[key]) != len(chunk["check"]) for key in keys) or chunk["id"] != chunk["check"]:
+                        raise ExtractionError(f"Notes changed while notes {note_count + 1} to {note_count + len(chunk['check'])} were read")
+                    if seen_ids.intersection(chunk["id"]) or len(set(chunk["id"])) != len(chunk["id"]):
+                        raise ExtractionError(f"Notes shifted while being read, so some were read twice after {note_count} notes")
+                    seen_ids.update(chunk["id"])
+                    for note_id, title, created, updated, note_body in zip(*(chunk[key] for key in keys)):
+                        note = {"id": note_id, "title": title, "folder": folders.get(note_id, ""),
+                                "created": created, "updated": updated, "body": note_body.strip()}
                         yield note
                         note_count += 1
                         progress.update(1)
                         progress.label = f"Parsing note {note_count} of {total_notes}"
-                    note, body = {}, []
-                    continue
-                found_key = False
-                for key in ("id", "title", "folder", "created", "updated"):
-                    if line.startswith(f"{split}-{key}: "):
-                        note[key] = line[len(f"{split}-{key}: "):]
-                        found_key = True
-                        break
-                if not found_key:
-                    body.append(line)
+                    chunk = {key: [] for key in (*keys, "check")}
+                elif key == "member":
+                    folder_id, note_id = value.decode("utf-8").split(" ", 1)
+                    folders[note_id] = folder_id
+                elif key in chunk:
+                    chunk[key].append(value.decode("utf-8", errors="replace"))
+        finish_extraction(process, messages, note_count, total_notes)
 
-    def upload(self, stop_after: Optional[int] = None) -> None:
+    def extract_notes_sqlite(self, since: Optional[datetime] = None,
+                             note_ids: Optional[Set[str]] = None) -> Generator[Dict[str, str], None, None]:
+        """
+        Extract notes, or only the notes with the given ids, by reading NoteStore.sqlite directly, without launching Notes.app.
+
+        Bodies come from the note's protobuf text rather than Notes.app's HTML rendering, and
+        password-protected notes are skipped because their data is encrypted.
+        """
+        with self.open_note_store() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ZICCLOUDSYNCINGOBJECT)")}
+            # The date columns have been renamed across macOS releases
+            created = next(c for c in ("ZCREATIONDATE3", "ZCREATIONDATE1", "ZCREATIONDATE") if c in columns)
+            updated = next(c for c in ("ZMODIFICATIONDATE1", "ZMODIFICATIONDATE") if c in columns)
+            query = NOTE_STORE_QUERY.format(created=created, updated=updated)
+            if note_ids is not None:
+                primary_keys = [note_id.rsplit("/p", 1)[-1] for note_id in note_ids]
+                query += f" AND note.Z_PK IN ({', '.join(pk for pk in primary_keys if pk.isdigit()) or 'NULL'})"
+            elif since is not None:
+                query += f" AND note.{updated} > {since.timestamp() - CORE_DATA_EPOCH_OFFSET}"
+            store_uuid = conn.execute("SELECT Z_UUID FROM Z_METADATA").fetchone()[0]
+            total_notes = conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+            with typer.progressbar(length=total_notes, label="Parsing notes") as progress:
+                for note_count, (pk, identifier, title, folder, created_at, updated_at, zdata) in enumerate(conn.execute(query), 1):
+                    note = {
+                        "id": f"x-coredata://{store_uuid}/ICNote/p{pk}",
+                        "title": title or "",
+                        "folder": f"x-coredata://{store_uuid}/ICFolder/p{folder}" if folder else "",
+                        "created": core_data_timestamp(created_at),
+                        "updated": core_data_timestamp(updated_at),
+                        "body": decode_note_body(zdata),
+                        "real_id": identifier,
+                    }
+                    yield note
+                    progress.update(1)
+                    progress.label = f"Parsing note {note_count} of {total_notes}"
+
+    def upload(self, stop_after: Optional[int] = None, backend: Optional[str] = None, full: bool = False,
+               workers: Optional[int] = None, verify: bool = False, batch_size: Optional[int] = None,
+               concurrency: Optional[int] = None, pack: Optional[bool] = None, wait: bool = False) -> None:
         """
         Upload new or updated notes to the vector store.
 
+        Extraction, filtering, serialization and upload run as a pipeline joined by bounded queues,
+        so uploads start while notes are still being extracted and memory stays flat. The command
+        returns once the files are sent; indexing is followed up by check_upload_batches.
+
         Args:
             stop_after (Optional[int]): If provided, stop after processing this many notes.
+            backend (Optional[str]): Extraction backend to use instead of the configured one.
+            full (bool): If True, extract every note instead of only those modified since the last sync.
+            workers (Optional[int]): Number of concurrent osascript processes for the parallel backend.
+            verify (bool): If True, extract and re-hash every note instead of trusting unchanged modification dates.
+            batch_size (Optional[int]): Files added to the vector store per file batch. Defaults to the configured size.
+            concurrency (Optional[int]): Concurrent file upload requests. Defaults to the configured limit.
+            pack (Optional[bool]): Whether to pack small notes into shared bundle files. Defaults to the configured mode.
+            wait (bool): If True, wait for the vector store to finish indexing instead of returning once the files are sent.
         """
-        notes = list(self.extract_notes())[:stop_after] if stop_after else list(self.extract_notes())
-        new_notes = [note for note in notes if note['hash'] not in self.config.embedded_notes]
-        typer.echo(f"Extracted {len(notes)} notes. {len(new_notes)} are new or updated.")
-        if not new_notes:
+        sync_started = datetime.now(timezone.utc)
+        state = self.config.state
+        pack = self.config.pack_notes if pack is None else pack
+        batch_size = batch_size or self.config.upload_batch_size
+        concurrency = concurrency or self.config.upload_concurrency
+        # Runs first so notes requeued from failed batches are sent again by this upload
+        self.check_upload_batches_in_background()
+        self.list_baseline_files()
+        since = None if full or verify or stop_after else self.config.last_sync
+        self.recover_interrupted_uploads()
+        new_notes: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        staged_files: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        uploads: List[NoteFileRecord] = []
+        failed: List[str] = []
+        # Small notes fill one bundle at a time, which is queued for upload as soon as it is full
+        open_bundle: List[Tuple[UploadRecord, bytes]] = []
+        run_id = secrets.token_hex(8)
+        extracted_ids: Set[str] = set()
+        extraction_errors: List[ExtractionError] = []
+        extracted_count = new_count = staged_count = bundle_count = open_size = 0
+        stages = [
+            start_stage(self.serialize_notes, new_notes, staged_files, stop, stop=stop, errors=errors),
+            start_stage(self.upload_files, staged_files, uploads, failed, stop, batch_size, concurrency, stop=stop, errors=errors),
+        ]
+        live_ids: Set[str] = set()
+
+        def stage_bundle() -> bool:
+            nonlocal staged_count, bundle_count, open_size
+            members = tuple((record, zlib.compress(section)) for record, section in open_bundle)
+            content = b"".join(section for _, section in open_bundle)
+            item: StagedNote = (BundleRecord(secrets.token_hex(8), None, members),
+                                {None: (f"chat_apple_notes_{run_id}_bundle_{bundle_count}.txt", content)})
+            open_bundle.clear()
+            open_size = 0
+            staged_count += 1
+            bundle_count += 1
+            return queue_put(staged_files, item, stop)
+
+        def stage_notes(notes: Iterable[Dict[str, str]]) -> None:
+            nonlocal extracted_count, new_count, staged_count, open_size
+            for batch in batched(until_extraction_error(notes, extraction_errors), PIPELINE_QUEUE_SIZE):
+                batch_ids = [note['id'] for note in batch]
+                if len(set(batch_ids)) != len(batch_ids) or not extracted_ids.isdisjoint(batch_ids):
+                    # An index walk reads a note twice when notes move under it, and may skip another to match the count
+                    extraction_errors.append(ExtractionError("A note was extracted twice because notes changed while being read"))
+                    return
+                extracted_count += len(batch)
+                extracted_ids.update(batch_ids)
+                changed, unchanged = self.config.partition(batch)
+                state.record_unchanged(unchanged)
+                new_count += len(changed)
+                if pack:
+                    sections = self.note_sections(changed)
+                    packed_ids = {record.note_id for record, _ in sections}
+                    for record, section in sections:
+                        if open_size + record.size > PACK_TARGET_SIZE and not stage_bundle():
+                            return
+                        open_bundle.append((record, section))
+                        open_size += record.size
+                    changed = [note for note in changed if note['id'] not in packed_ids]
+                staged_count += len(changed)
+                if not all(queue_put(new_notes, note, stop) for note in changed):
+                    return
+
+        try:
+            stage_notes(islice(self.extract_notes(backend, since, workers, reuse_hashes=not verify), stop_after))
+            # Deletions are detected from a separate id listing, which is a single Apple Event or query and so cannot
+            # skip notes the way a walk over the notes can; an incremental extraction only sees modified notes anyway
+            if not stop_after and not extraction_errors and not stop.is_set():
+                live_ids = self.list_note_ids(backend)
+                # Requeued notes and notes that synced from another device with an older modification date than
+                # the watermark are missed by the date filter, so they are extracted by id, as are any the walk skipped
+                missed_ids = ((state.requeued_note_ids() | (live_ids - state.note_ids())) & live_ids) - extracted_ids
+                if missed_ids:
+                    stage_notes(self.extract_notes(backend, note_ids=missed_ids))
+            queue_put(new_notes, PIPELINE_DONE, stop)
+            if extraction_errors:
+                # The notes read so far are still uploaded, but a partial listing cannot be used to find deleted notes
+                typer.echo(f"\nWarning: {str(extraction_errors[0])}. "
+                           "Deleted notes are not synced and the next upload extracts these notes again.")
+        except DiskAccessError as e:
+            typer.echo(f"\nError: {str(e)}")
+            errors.append(e)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            if errors:
+                stop.set()
+            self.wait_for_uploads(stages, uploads, staged_count)
+        if errors:
+            if isinstance(errors[0], DiskAccessError):
+                return
+            raise errors[0]
+        if since:
+            typer.echo(f"Extracted {extracted_count} notes modified since the last sync. {new_count} are new or updated.")
+        else:
+            typer.echo(f"Extracted {extracted_count} notes. {new_count} are new or updated.")
+        if not stop_after and not extraction_errors:
+            self.reconcile_deleted_notes(live_ids)
+        added_count = sum(len(record.note_ids) for record in uploads)
+        # Runs after deletions are reconciled so bundles that lost a member are rebuilt in the same sync
+        added_count += self.pack_notes(open_bundle, uploads, failed, batch_size, concurrency)
+        state.clear_requeued(extracted_ids - set(failed))
+        if wait:
+            self.wait_for_indexing()
+        # Notes that failed to upload must be extracted again, so the watermark only moves on a clean run
+        if not stop_after and not extraction_errors and not failed:
+            self.record_sync(sync_started)
+        self.purge_stale_files()
+        if not new_count:
             typer.echo("No new or updated notes to add. Vector store is up to date.")
             return
-        typer.echo("Uploading new or updated notes to vector store...")
-        with tempfile.TemporaryDirectory() as temp_dir:
-            file_paths = []
-            for i, note in enumerate(new_notes):
-                file_path = os.path.join(temp_dir, f"note_{i}.txt")
-                with open(file_path, 'w') as f:
-                    f.write(f"Title: {note['title']}\nID: {note['real_id']}\n\nContent: {note['body']}")
-                file_paths.append(file_path)
-            with typer.progressbar(file_paths, label="Uploading notes") as progress:
-                for i, file_path in enumerate(progress):
-                    with open(file_path, 'rb') as file:
-                        self.client.beta.vector_stores.file_batches.upload_and_poll(
-                            vector_store_id=self.config.vector_store_id,
-                            files=[file]
-                        )
-                    progress.label = f"Uploading note {i + 1} of {len(file_paths)}"
-        self.config.add_embedded_notes([note['hash'] for note in new_notes])
-        typer.echo(f"Added {len(new_notes)} new or updated notes to the vector store.")
+        typer.echo(f"Added {added_count} new or updated notes to the vector store.")
+        if not wait and self.config.state.upload_batches():
+            typer.echo("The vector store is indexing them in the background. Run upload-status to check on progress.")
+
+    def note_sections(self, notes: List[Dict[str, str]]) -> List[Tuple[UploadRecord, bytes]]:
+        """Serialize the notes small enough to pack into delimited bundle sections, paired with their records."""
+        sections: List[Tuple[UploadRecord, bytes]] = []
+        for note in notes:
+            section = (f"===== Note =====\nTitle: {note['title']}\nID: {note['real_id']}\nFolder: {note.get('folder', '')}\n\n"
+                       f"Content: {note['body']}\n\n").encode()
+            if len(section) <= PACK_NOTE_THRESHOLD:
+                sections.append((UploadRecord(note['id'], note['hash'], None, len(section), note.get('updated')), section))
+        return sections
+
+    def pack_notes(self, sections: List[Tuple[UploadRecord, bytes]], uploads: List[NoteFileRecord], failed: List[str],
+                   batch_size: int, concurrency: int) -> int:
+        """
+        Bin-pack the small notes left in upload's open bundle and rebuild the bundles affected by changes.
+
+        Only bundles that hold an updated or deleted note are rebuilt, from the sections stored for
+        their other members; the given notes fill the space in those bundles first and new bundles
+        after that, first-fit by decreasing size.
+
+        Returns:
+            int: The number of the given notes that were uploaded.
+        """
+        state = self.config.state
+        changed_ids = {record.note_id for record, _ in sections}
+        affected = state.dirty_bundle_ids() | state.bundle_ids(changed_ids)
+        if not sections and not affected:
+            return 0
+        # Recorded up front so a bundle is rebuilt on the next run if this one fails part way
+        state.mark_bundles_dirty(affected)
+        bundles: List[Tuple[str, List[Tuple[UploadRecord, bytes]], int]] = []
+        for bundle_id in affected:
+            members = [member for member in state.bundle_members(bundle_id) if member[0].note_id not in changed_ids]
+            bundles.append((bundle_id, members, sum(record.size for record, _ in members)))
+        for record, section in sorted(sections, key=lambda item: item[0].size, reverse=True):
+            for i, (bundle_id, members, size) in enumerate(bundles):
+                if size + record.size <= PACK_TARGET_SIZE:
+                    break
+            else:
+                i = len(bundles)
+                bundles.append((secrets.token_hex(8), [], 0))
+            bundle_id, members, size = bundles[i]
+            members.append((record, zlib.compress(section)))
+            bundles[i] = (bundle_id, members, size + record.size)
+        # Bundles whose changed notes moved elsewhere are dropped once those notes are recorded in their new bundles
+        moved = state.bundle_ids(changed_ids)
+        state.drop_bundles(bundle_id for bundle_id, members, _ in bundles if not members and bundle_id not in moved)
+        run_id = secrets.token_hex(8)
+        staged: List[StagedNote] = [
+            (BundleRecord(bundle_id, None, tuple(members)),
+             {None: (f"chat_apple_notes_{run_id}_bundle_{i}.txt", b"".join(zlib.decompress(content) for _, content in members))})
+            for i, (bundle_id, members, _) in enumerate(bundle for bundle in bundles if bundle[1])
+        ]
+        if not staged:
+            return 0
+        typer.echo(f"Uploading {len(staged)} bundle files ({len(sections)} new or updated small notes)...")
+        bundle_uploads: List[NoteFileRecord] = []
+        asyncio.run(self.upload_files_async(iter(staged), bundle_uploads, failed, batch_size, concurrency))
+        uploads.extend(bundle_uploads)
+        return sum(note_id in changed_ids for record in bundle_uploads for note_id in record.note_ids)
+
+    def serialize_notes(self, notes: queue.Queue, files: queue.Queue, stop: threading.Event) -> None:
+        """
+        Pipeline stage that serializes each new note into in-memory files ready for upload.
+
+        Long notes are split into content-defined chunks, and only chunks not already uploaded for
+        the note are serialized, so an edit re-uploads just the chunks it touched.
+        """
+        # File names must be told apart across runs by the upload journal
+        run_id = secrets.token_hex(8)
+        for i, note in enumerate(queue_drain(notes, stop)):
+            header = f"Title: {note['title']}\nID: {note['real_id']}\n\nContent: "
+            if len(note['body'].encode()) <= CHUNKING_THRESHOLD:
+                content = (header + note['body']).encode()
+                record = UploadRecord(note['id'], note['hash'], None, len(content), note.get('updated'))
+                item: StagedNote = (record, {None: (f"chat_apple_notes_{run_id}_note_{i}.txt", content)})
+            else:
+                existing = self.config.state.chunk_files(note['id'])
+                chunks: Dict[str, Tuple[Optional[str], int]] = {}
+                named_files: Dict[Optional[str], Tuple[str, bytes]] = {}
+                for j, chunk in enumerate(chunk_text(note['body'])):
+                    content = (header + chunk).encode()
+                    chunk_hash = hashlib.sha256(content).hexdigest()
+                    if chunk_hash in chunks:
+                        continue
+                    if chunk_hash in existing:
+                        chunks[chunk_hash] = existing[chunk_hash]
+                        continue
+                    named_files[chunk_hash] = (f"chat_apple_notes_{run_id}_note_{i}_{j}.txt", content)
+                    chunks[chunk_hash] = (None, len(content))
+                record = UploadRecord(note['id'], note['hash'], None, sum(size for _, size in chunks.values()),
+                                      note.get('updated'), tuple((h, file_id, size) for h, (file_id, size) in chunks.items()))
+                item = (record, named_files)
+            if not queue_put(files, item, stop):
+                return
+        queue_put(files, PIPELINE_DONE, stop)
+
+    def upload_files(self, files: queue.Queue, uploads: List[NoteFileRecord], failed: List[str], stop: threading.Event,
+                     batch_size: int, concurrency: int) -> None:
+        """
+        Pipeline stage that uploads serialized notes, or their changed chunks, to the vector store in file batches.
+
+        Uploads run on an asyncio event loop owned by this stage, so many files are in flight at
+        once and several batches upload side by side. Each batch is checkpointed in the sync state
+        as soon as its files are sent and added to the vector store, without waiting for indexing,
+        so an interrupted run loses at most the batches that were in flight.
+        """
+        asyncio.run(self.upload_files_async(queue_drain(files, stop), uploads, failed, batch_size, concurrency))
+
+    async def upload_files_async(self, items: Iterator[StagedNote], uploads: List[NoteFileRecord],
+                                 failed: List[str], batch_size: int, concurrency: int) -> None:
+        """Group serialized notes into file batches and upload up to MAX_PENDING_BATCHES of them concurrently."""
+        self.rate_limiter.set_max_concurrency(concurrency)
+        requests = AdaptiveSemaphore(self.rate_limiter)
+        pending: Set[asyncio.Task] = set()
+        batch: List[StagedNote] = []
+        file_count = 0
+        async with self.async_client() as client:
+            try:
+                while True:
+                    # The queue blocks, so it is read from a worker thread while uploads carry on
+                    item = await asyncio.to_thread(next, items, None)
+                    if item is None or (batch and file_count + len(item[1]) > batch_size):
+                        if batch:
+                            if len(pending) >= MAX_PENDING_BATCHES:
+                                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                                for task in done:
+                                    task.result()
+                            pending.add(asyncio.create_task(self.upload_batch(client, requests, batch, uploads, failed)))
+                        batch, file_count = [], 0
+                    if item is None:
+                        break
+                    batch.append(item)
+                    file_count += len(item[1])
+                for task in asyncio.as_completed(pending):
+                    await task
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def async_client(self) -> AsyncOpenAI:
+        """An async OpenAI client for the upload engine; retries are handled by with_retries instead of the SDK."""
+        return AsyncOpenAI(api_key=self.config.openai_api_key, max_retries=0,
+                           http_client=self.rate_limiter.async_http_client())
+
+    async def with_retries(self, request: Callable[[], Any]) -> Any:
+        """
+        Await a request, retrying rate limits, server errors and dropped connections.
+
+        Retries back off exponentially with full jitter, waiting at least as long as a Retry-After header asks.
+        """
+        for attempt in range(UPLOAD_ATTEMPTS):
+            try:
+                return await request()
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                if attempt == UPLOAD_ATTEMPTS - 1:
+                    raise
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                response = getattr(e, "response", None)
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                if retry_after and retry_after.replace(".", "", 1).isdigit():
+                    delay = max(delay, float(retry_after))
+                await asyncio.sleep(delay)
+
+    async def upload_batch(self, client: AsyncOpenAI, requests: AdaptiveSemaphore,
+                           batch: List[StagedNote], uploads: List[NoteFileRecord],
+                           failed: List[str]) -> None:
+        """
+        Upload the files of several notes concurrently and add them to the vector store as one file batch.
+
+        Notes whose files all indexed are recorded; files of notes with any failed file are queued
+        for deletion and the failures reported, and those notes are retried on the next upload.
+        """
+        state = self.config.state
+        named_files = [named_file for _, files in batch for named_file in files.values()]
+        state.begin_uploads(filename for filename, _ in named_files)
+        results = await asyncio.gather(*(self.create_file(client, requests, named_file) for named_file in named_files),
+                                       return_exceptions=True)
+        for result in results:
+            # Only request errors count as failed files; cancellation and interrupts stop the upload
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        file_ids = {filename: result for (filename, _), result in zip(named_files, results) if isinstance(result, str)}
+        errors = {filename: str(result) for (filename, _), result in zip(named_files, results) if isinstance(result, Exception)}
+        batch_id = None
+        if file_ids:
+            # Indexing is not waited for; check_upload_batches follows the batch up and requeues failed files
+            vector_store_batch = await self.with_retries(lambda: client.beta.vector_stores.file_batches.create(
+                vector_store_id=self.config.vector_store_id,
+                file_ids=list(file_ids.values())
+            ))
+            batch_id = vector_store_batch.id
+            state.add_upload_batch(batch_id, len(file_ids))
+        records: List[NoteFileRecord] = []
+        for record, files in batch:
+            filenames = {key: filename for key, (filename, _) in files.items()}
+            if any(filename in errors for filename in filenames.values()):
+                state.mark_stale(file_ids[filename] for filename in filenames.values() if filename in file_ids)
+                continue
+            records.append(record.with_file_ids({key: file_ids[filename] for key, filename in filenames.items()}))
+        # Files whose upload raised stay journaled, since the request may still have created them
+        state.record_uploads(records, filenames=file_ids, batch_id=batch_id)
+        uploads.extend(records)
+        if errors:
+            failed_ids = [note_id for record, files in batch if any(filename in errors for filename, _ in files.values())
+                          for note_id in record.note_ids]
+            failed.extend(failed_ids)
+            typer.echo(f"\nFailed to upload {len(errors)} files of {len(failed_ids)} notes ({next(iter(errors.values()))}). "
+                       "They will be retried on the next upload.")
+
+    async def create_file(self, client: AsyncOpenAI, requests: AdaptiveSemaphore, named_file: Tuple[str, bytes]) -> str:
+        """Upload an in-memory file for use by the vector store and return its id."""
+        async with requests:
+            uploaded = await self.with_retries(lambda: client.files.create(file=named_file, purpose="assistants"))
+            return uploaded.id
+
+    def check_upload_batches(self) -> Tuple[int, int]:
+        """
+        Poll outstanding file batches, requeueing the notes of files that failed to index.
+
+        Once a batch is done, the files its notes replaced are deleted from the vector store.
+
+        Requeued notes are forgotten by the sync state and queued in requeued_notes, so the next
+        upload extracts them by id and sends them again.
+
+        Returns:
+            Tuple[int, int]: The number of batches still indexing and the number of notes requeued.
+        """
+        state = self.config.state
+        self.last_batch_check = time.monotonic()
+        in_progress = finished = 0
+        requeued: Set[str] = set()
+        for batch_id, _ in state.upload_batches():
+            try:
+                vector_store_batch = self.client.beta.vector_stores.file_batches.retrieve(
+                    batch_id, vector_store_id=self.config.vector_store_id)
+            except NotFoundError:
+                state.finish_upload_batch(batch_id)
+                finished += 1
+                continue
+            if vector_store_batch.status == "in_progress":
+                in_progress += 1
+                continue
+            failed_ids = [vector_store_file.id
+                          for status in ("failed", "cancelled") if getattr(vector_store_batch.file_counts, status)
+                          for vector_store_file in self.client.beta.vector_stores.file_batches.list_files(
+                              batch_id, vector_store_id=self.config.vector_store_id, filter=status)]
+            requeued |= state.requeue_files(failed_ids)
+            state.finish_upload_batch(batch_id)
+            finished += 1
+        if finished:
+            self.purge_stale_files()
+        if requeued:
+            typer.echo(f"{len(requeued)} notes failed to index in the vector store. They will be uploaded again on the next upload.")
+        return in_progress, len(requeued)
+
+    def check_upload_batches_in_background(self) -> None:
+        """
+        Check outstanding file batches from other commands, at most every BATCH_CHECK_INTERVAL seconds.
+
+        A failed check only prints a warning, so it never stops the command it runs alongside.
+        """
+        if not os.path.exists(STATE_FILE) or time.monotonic() - self.last_batch_check < BATCH_CHECK_INTERVAL:
+            return
+        try:
+            if self.config.state.upload_batches():
+                self.check_upload_batches()
+        except Exception as e:
+            typer.echo(f"Warning: could not check on uploads still being indexed: {e}")
+        self.last_batch_check = time.monotonic()
+
+    def wait_for_indexing(self) -> int:
+        """
+        Block until every outstanding file batch has finished indexing.
+
+        Returns:
+            int: The number of notes requeued because their files failed to index.
+        """
+        requeued = 0
+        total = sum(file_count for _, file_count in self.config.state.upload_batches())
+        if not total:
+            return 0
+        typer.echo(f"Waiting for the vector store to index {total} files...")
+        while True:
+            in_progress, newly_requeued = self.check_upload_batches()
+            requeued += newly_requeued
+            if not in_progress:
+                return requeued
+            time.sleep(BATCH_POLL_INTERVAL)
+
+    def upload_status(self) -> None:
+        """Report on outstanding file batches, recording finished ones and requeueing failed files."""
+        in_progress, _ = self.check_upload_batches()
+        if in_progress:
+            files = sum(file_count for _, file_count in self.config.state.upload_batches())
+            typer.echo(f"{in_progress} upload batches ({files} files) are still being indexed.")
+        else:
+            typer.echo("All uploads have been indexed.")
+
+    def recover_interrupted_uploads(self) -> int:
+        """
+        Queue files left behind by a run that stopped between uploading a file and recording it.
+
+        The upload journal names the files whose result was never recorded; any of them that reached
+        OpenAI are looked up by file name and queued in stale_files, and their notes are uploaded again.
+        """
+        state = self.config.state
+        pending = state.pending_uploads()
+        if not pending:
+            return 0
+        typer.echo("Resuming after an interrupted upload...")
+        orphaned = [file.id for file in self.client.files.list(purpose="assistants") if file.filename in pending]
+        state.mark_stale(orphaned)
+        state.end_uploads(pending)
+        return len(orphaned)
+
+    def delete_file(self, file_id: str) -> None:
+        """Remove a file from the vector store and delete the underlying file."""
+        for delete in (lambda: self.client.beta.vector_stores.files.delete(file_id, vector_store_id=self.config.vector_store_id),
+                       lambda: self.client.files.delete(file_id)):
+            try:
+                delete()
+            except NotFoundError:
+                pass
+
+    def list_baseline_files(self) -> None:
+        """Record the vector store files left by a version of the app that did not track file ids, after migrating from it."""
+        if not self.config.list_baseline_files:
+            return
+        file_ids = [file.id for file in self.client.beta.vector_stores.files.list(vector_store_id=self.config.vector_store_id)]
+        self.config.state.add_baseline_files(file_ids)
+        self.config.update_config(list_baseline_files=False)
+
+    def reconcile_deleted_notes(self, live_ids: Set[str]) -> int:
+        """Forget tracked notes missing from the current extraction so their files are deleted from the vector store."""
+        tracked_ids = self.config.state.note_ids()
+        requeued_ids = self.config.state.requeued_note_ids()
+        if (tracked_ids or requeued_ids) and not live_ids:
+            # An empty listing almost certainly means Notes could not be read, not that every note was deleted
+            typer.echo("Warning: no notes were found in Apple Notes. Skipping deletion sync.")
+            return 0
+        # A requeued note is no longer tracked, but would hold back releasing baseline files until extracted again
+        self.config.state.clear_requeued(requeued_ids - live_ids)
+        deleted_ids = tracked_ids - live_ids
+        if deleted_ids:
+            self.config.state.forget_notes(deleted_ids)
+            typer.echo(f"{len(deleted_ids)} notes were deleted from Apple Notes since the last sync.")
+        return len(deleted_ids)
+
+    def purge_stale_files(self) -> int:
+        """
+        Concurrently delete vector store files of deleted notes and of superseded note versions.
+
+        A superseded version is only deleted once the file batch holding its replacement has finished
+        indexing. Files that fail to delete stay queued and are retried on the next upload.
+        Files uploaded before the sync state tracked file ids are queued once a sync has
+        succeeded and every note it sent has been indexed.
+        """
+        state = self.config.state
+        if self.config.last_sync and not state.upload_batches() and not state.requeued_note_ids():
+            state.release_baseline_files()
+        stale_ids = state.stale_file_ids()
+        if not stale_ids:
+            return 0
+        deleted: List[str] = []
+        failures = 0
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+            futures = {pool.submit(self.delete_file, file_id): file_id for file_id in stale_ids}
+            for future, file_id in futures.items():
+                if future.exception() is None:
+                    deleted.append(file_id)
+                else:
+                    failures += 1
+        state.discard_stale_files(deleted)
+        typer.echo(f"Removed {len(deleted)} stale files from the vector store.")
+        if failures:
+            typer.echo(f"Failed to remove {failures} files. They will be retried on the next upload.")
+        return len(deleted)
+
+    def wait_for_uploads(self, stages: List[threading.Thread], uploads: List[NoteFileRecord], total: int) -> None:
+        """Show upload progress until the pipeline stages have finished."""
+        if any(stage.is_alive() for stage in stages) and total:
+            typer.echo("Uploading new or updated notes to vector store...")
+            with typer.progressbar(length=total, label="Uploading notes") as progress:
+                shown = 0
+                while any(stage.is_alive() for stage in stages):
+                    time.sleep(0.1)
+                    progress.update(len(uploads) - shown)
+                    shown = len(uploads)
+                    progress.label = f"Uploading note {shown} of {total}"
+                progress.update(len(uploads) - shown)
+        for stage in stages:
+            stage.join()
+
+    def record_sync(self, sync_started: datetime) -> None:
+        """Store the watermark of a completed sync for the next incremental upload."""
+        self.config.update_config(last_sync=sync_started.isoformat(timespec="seconds"))
 
     def search(self, query: Optional[str] = None) -> None:
         """Perform a semantic search on the notes and display results."""
@@ -366,6 +2177,7 @@ def display_main_functions() -> None:
     """Display the main functions available in the Apple Notes Assistant."""
     typer.echo("\nAvailable commands:")
     typer.echo("• upload: Extract notes and add them to the vector store")
+    typer.echo("• upload-status: Check on notes still being indexed by the vector store")
     typer.echo("• search: Perform a semantic search on your notes")
     typer.echo("• ask: Ask a question about your notes")
     typer.echo("• chat: Start a chat session with the assistant")
@@ -394,8 +2206,16 @@ def interactive():
 
 def process_command(command: str, notes_assistant: NotesAssistant):
     try:
-        if command == "upload":
-            notes_assistant.upload()
+        name = command.split()[0] if command.split() else ""
+        # The update commands must keep working when the API key or disk access is what is broken
+        if name and name not in ("upload-status", "update-api", "update-privileges"):
+            notes_assistant.check_upload_batches_in_background()
+        if name == "upload" and command != "upload-status":
+            args = command.split()[1:]
+            pack = True if "--pack" in args else False if "--no-pack" in args else None
+            notes_assistant.upload(full="--full" in args, verify="--verify" in args, pack=pack, wait="--wait" in args)
+        elif command == "upload-status":
+            notes_assistant.upload_status()
         elif command.startswith("search"):
             _, *query = command.split(maxsplit=1)
             notes_assistant.search(" ".join(query) if query else None)
@@ -420,19 +2240,37 @@ def process_command(command: str, notes_assistant: NotesAssistant):
         typer.echo(f"Error: {e}")
 
 @app.command()
-def upload():
+def upload(backend: Optional[str] = typer.Option(None, help=f"Extraction backend: {', '.join(EXTRACTION_BACKENDS)}"),
+           full: bool = typer.Option(False, "--full", help="Extract every note instead of only those modified since the last sync"),
+           workers: Optional[int] = typer.Option(None, help="Concurrent osascript processes for the parallel backend"),
+           verify: bool = typer.Option(False, "--verify", help="Re-hash every note instead of trusting unchanged modification dates"),
+           batch_size: Optional[int] = typer.Option(None, min=1, max=MAX_UPLOAD_BATCH_SIZE, help="Files added to the vector store per file batch"),
+           concurrency: Optional[int] = typer.Option(None, min=1, help="Concurrent file upload requests"),
+           pack: Optional[bool] = typer.Option(None, "--pack/--no-pack", help="Pack small notes into shared bundle files"),
+           wait: bool = typer.Option(False, "--wait", help="Wait for the vector store to finish indexing the uploaded notes")):
     """Extract notes and add them to the vector store"""
     try:
         notes_assistant = NotesAssistant()
-        notes_assistant.upload()
+        notes_assistant.upload(backend=backend, full=full, workers=workers, verify=verify, batch_size=batch_size,
+                               concurrency=concurrency, pack=pack, wait=wait)
     except Exception as e:
         typer.echo(f"Error during upload: {e}")
 
+@app.command()
+def upload_status():
+    """Check on notes still being indexed by the vector store"""
+    try:
+        notes_assistant = NotesAssistant()
+        notes_assistant.upload_status()
+    except Exception as e:
+        typer.echo(f"Error while checking upload status: {e}")
+
 @app.command()
 def search(query: Optional[str] = typer.Argument(None)):
     """Perform a semantic search on your notes"""
     try:
         notes_assistant = NotesAssistant()
+        notes_assistant.check_upload_batches_in_background()
         notes_assistant.search(query)
     except Exception as e:
         typer.echo(f"Error during search: {e}")
@@ -442,6 +2280,7 @@ def ask(question: Optional[str] = typer.Argument(None)):
     """Ask a question about your notes"""
     try:
         notes_assistant = NotesAssistant()
+        notes_assistant.check_upload_batches_in_background()
         notes_assistant.ask(question)
     except Exception as e:
         typer.echo(f"Error while asking question: {e}")
@@ -451,6 +2290,7 @@ def chat():
     """Start a chat session with the assistant"""
     try:
         notes_assistant = NotesAssistant()
+        notes_assistant.check_upload_batches_in_background()
         notes_assistant.chat()
     except Exception as e:
         typer.echo(f"Error during chat session: {e}")